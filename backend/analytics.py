@@ -0,0 +1,466 @@
+"""
+Vectorized portfolio analytics.
+
+Holdings are pivoted once into a dates x tickers share matrix and multiplied against the
+aligned price matrix, so every endpoint is a handful of array operations instead of
+per-group Python loops.
+"""
+import base64
+from datetime import date
+from functools import cached_property
+import threading
+
+import numpy as np
+import pandas as pd
+
+from price_store import PriceMatrix
+
+UNKNOWN_SECTOR = "Unknown"
+TRADE_COLUMNS = ["Date", "Ticker", "Quantity", "TotalPrice", "UnitPrice", "Type"]
+
+
+def format_dates(dates) -> list:
+    """Holdings dates (datetime64 or date strings) as the "YYYY-MM-DD" strings price matrices use."""
+    return pd.to_datetime(dates).strftime("%Y-%m-%d").tolist()
+
+
+def share_matrix(holdings: pd.DataFrame):
+    """
+    Pivot long-format holdings (Date, Symbol, Shares) into a dense share matrix.
+
+    Returns:
+        tuple: (dates, tickers, shares) where dates are "YYYY-MM-DD" strings and shares is a float
+        array of shape (len(dates), len(tickers)) with 0 for tickers not held on a date.
+    """
+    pivot = holdings.pivot_table(
+        index="Date", columns="Symbol", values="Shares", aggfunc="sum", fill_value=0, observed=True
+    )
+    pivot = pivot.sort_index()
+    return format_dates(pivot.index), [str(ticker) for ticker in pivot.columns], pivot.to_numpy(dtype=float)
+
+
+def align_prices(prices: PriceMatrix, dates, tickers) -> np.ndarray:
+    """Gather prices for the given dates x tickers grid, NaN where the matrix has no value."""
+    rows = np.array([prices.date_index.get(date, -1) for date in dates], dtype=np.intp)
+    cols = np.array([prices.ticker_index.get(ticker, -1) for ticker in tickers], dtype=np.intp)
+    aligned = np.full((len(rows), len(cols)), np.nan)
+    if prices.values.size and len(rows) and len(cols):
+        aligned[:] = prices.values[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))]
+        aligned[rows < 0, :] = np.nan
+        aligned[:, cols < 0] = np.nan
+    return aligned
+
+
+class Valuation:
+    """
+    Share matrix, aligned prices and per-cell market values for one holdings set.
+
+    With step_holdings=False the valuation dates are the holdings dates (the monthly view). With
+    step_holdings=True every price date from the first holdings date on is valued, carrying each
+    month's shares forward until the next holdings date (daily and weekly views).
+
+    Per-cell matrices are built on first use. portfolio_values can be passed in when it was already
+    computed for a whole batch of portfolios (see ValuationBatch). previous is an earlier valuation
+    of the same portfolio against the same prices, with the holdings dates that changed since; its
+    trades are reused for every other date.
+    """
+
+    def __init__(
+        self, holdings: pd.DataFrame, prices: PriceMatrix, step_holdings: bool = False, portfolio_values=None,
+        previous=None,
+    ):
+        self.prices = prices
+        self._previous = previous
+        self.dates, self.tickers, self.holding_shares = share_matrix(holdings)
+        self._share_rows = None
+        if step_holdings and self.dates:
+            holding_dates = np.asarray(self.dates)
+            self.dates = [date for date in prices.dates if date >= self.dates[0]]
+            self._share_rows = np.searchsorted(holding_dates, self.dates, side="right") - 1
+        self.integral_shares = holdings["Shares"].dtype.kind in "iu"
+        if portfolio_values is not None:
+            self.portfolio_values = portfolio_values
+
+    @cached_property
+    def shares(self) -> np.ndarray:
+        """Shares held per valuation date x ticker."""
+        if self._share_rows is None:
+            return self.holding_shares
+        return self.holding_shares[self._share_rows]
+
+    @cached_property
+    def aligned_prices(self) -> np.ndarray:
+        return align_prices(self.prices, self.dates, self.tickers)
+
+    @cached_property
+    def priced(self) -> np.ndarray:
+        return ~np.isnan(self.aligned_prices)
+
+    @cached_property
+    def market_values(self) -> np.ndarray:
+        # Missing prices contribute nothing to a month's value
+        return np.where(self.priced, self.shares * np.nan_to_num(self.aligned_prices), 0.0)
+
+    @cached_property
+    def portfolio_values(self) -> np.ndarray:
+        return self.market_values.sum(axis=1)
+
+    def _trades_at(self, rows: np.ndarray) -> pd.DataFrame:
+        """Trades on the given valuation rows, from the change against each previous row."""
+        shares = self.shares[rows]
+        previous = np.where((rows > 0)[:, None], self.shares[np.maximum(rows - 1, 0)], 0.0)
+        delta = shares - previous
+        if "aligned_prices" in self.__dict__ or len(rows) == len(self.dates):
+            prices = self.aligned_prices[rows]
+        else:
+            prices = align_prices(self.prices, [self.dates[r] for r in rows], self.tickers)
+        hit_rows, cols = np.nonzero((delta != 0) & ~np.isnan(prices))
+
+        change = delta[hit_rows, cols]
+        quantity = np.abs(change)
+        if self.integral_shares:
+            quantity = quantity.astype(np.int64)
+        unit_price = prices[hit_rows, cols]
+        return pd.DataFrame(
+            {
+                "Date": np.asarray(self.dates, dtype=object)[rows[hit_rows]],
+                "Ticker": np.asarray(self.tickers, dtype=object)[cols],
+                "Quantity": quantity,
+                "TotalPrice": quantity * unit_price,
+                "UnitPrice": unit_price,
+                "Type": np.where(change > 0, "BUY", "SELL"),
+            },
+            columns=TRADE_COLUMNS,
+        )
+
+    @cached_property
+    def trades(self) -> pd.DataFrame:
+        """
+        Columnar trade table in chronological order, derived from month-over-month share changes.
+
+        Tickers missing from a month count as 0 shares, so full exits show up as SELLs. Trades on
+        dates without a price for the ticker are dropped. When an earlier valuation's trades are
+        available, only the changed dates and the dates right after them are recomputed.
+        """
+        previous, self._previous = self._previous, None
+        if previous is None or "trades" not in previous[0].__dict__ or self._share_rows is not None:
+            return self._trades_at(np.arange(len(self.dates)))
+
+        earlier, changed = previous
+        dates = np.asarray(self.dates, dtype=object)
+        # A trade depends on its own date's holdings and the previous date's
+        after = np.searchsorted(dates, np.asarray(changed, dtype=object), side="right")
+        affected = set(changed) | set(dates[after[after < len(dates)]])
+        rows = np.flatnonzero(np.isin(dates, list(affected)))
+        kept = earlier.trades[~earlier.trades["Date"].isin(affected).to_numpy()]
+        fresh = self._trades_at(rows)
+        # An empty frame's object columns would otherwise change the concatenated dtypes
+        trades = pd.concat([kept, fresh], ignore_index=True) if len(fresh) else kept
+        return trades.sort_values(["Date", "Ticker"], kind="stable").reset_index(drop=True)
+
+    @cached_property
+    def trades_newest_first(self) -> pd.DataFrame:
+        """Trades ordered by Date descending, then Ticker, which is the key order /trades pages over."""
+        return self.trades.sort_values(["Date", "Ticker"], ascending=[False, True], kind="stable").reset_index(drop=True)
+
+    def value_series(self):
+        return [
+            {"date": date, "value": round(float(value), 2)}
+            for date, value in zip(self.dates, self.portfolio_values)
+        ]
+
+    def performance_series(self, benchmark: str = "^GSPC"):
+        """
+        Portfolio and benchmark normalized to 100 at the first date that has a benchmark price.
+
+        Dates without a benchmark price are dropped. Returns None when either side is missing.
+        """
+        if not self.dates:
+            return None
+        benchmark_prices = align_prices(self.prices, self.dates, [benchmark])[:, 0]
+        keep = ~np.isnan(benchmark_prices)
+        if not keep.any():
+            return None
+
+        base = int(np.argmax(keep))  # First date with a benchmark price
+        portfolio = self.portfolio_values / self.portfolio_values[base] * 100
+        sp500 = benchmark_prices / benchmark_prices[base] * 100
+        keep[:base] = False
+        return [
+            {"date": date, "portfolio": float(p), "sp500": float(b)}
+            for date, p, b in zip(np.asarray(self.dates, dtype=object)[keep], portfolio[keep], sp500[keep])
+        ]
+
+    def sector_weights(self, sectors: dict):
+        """
+        Sector weights per date through a ticker -> sector one-hot matrix.
+
+        Tickers without a price on a date or with an unknown sector are excluded before normalizing.
+        """
+        names = sorted({sectors.get(t, UNKNOWN_SECTOR) for t in self.tickers} - {UNKNOWN_SECTOR})
+        sector_index = {name: k for k, name in enumerate(names)}
+        one_hot = np.zeros((len(self.tickers), len(names)))
+        for j, ticker in enumerate(self.tickers):
+            k = sector_index.get(sectors.get(ticker, UNKNOWN_SECTOR))
+            if k is not None:
+                one_hot[j, k] = 1.0
+
+        held = self.priced & (self.shares != 0)
+        sector_values = self.market_values @ one_hot
+        present = (held.astype(float) @ one_hot) > 0
+        totals = sector_values.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.where(totals != 0, sector_values / totals, 0.0)
+
+        names = np.asarray(names, dtype=object)
+        return [
+            {
+                "date": date,
+                "sectors": dict(zip(names[present[i]], weights[i, present[i]].tolist())),
+            }
+            for i, date in enumerate(self.dates)
+        ]
+
+
+def _symbol_codes(columns: list):
+    """Integer codes over the union of symbols, straight from category codes when all columns are categorical."""
+    if all(isinstance(column.dtype, pd.CategoricalDtype) for column in columns):
+        tickers = pd.Index(np.concatenate([column.cat.categories.to_numpy(dtype=object) for column in columns])).unique()
+        codes = [tickers.get_indexer(column.cat.categories)[column.cat.codes.to_numpy()] for column in columns]
+        return np.concatenate(codes), tickers.astype(str)
+    return pd.factorize(np.concatenate([column.to_numpy(dtype=object) for column in columns]))
+
+
+def batch_portfolio_values(holdings: dict, prices: PriceMatrix, step_holdings: bool = False) -> dict:
+    """
+    Value many holdings sets against one price matrix at once.
+
+    All portfolios share one ticker axis. Walking the union of holdings dates, a portfolios x tickers
+    share matrix carries every portfolio's latest holdings forward, and the price rows up to the next
+    holdings date are valued for all portfolios with a single matrix product. Missing prices count
+    as 0, as in Valuation.
+
+    Args:
+        holdings: {portfolio_id: long-format holdings (Date, Symbol, Shares)}.
+        step_holdings: Value every price date (daily/weekly views) instead of only holdings dates.
+
+    Returns:
+        dict: {portfolio_id: (dates, values)} matching Valuation.dates and Valuation.portfolio_values.
+    """
+    ids = [portfolio_id for portfolio_id, frame in holdings.items() if not frame.empty]
+    result = {portfolio_id: ([], np.zeros(0)) for portfolio_id in holdings}
+    if not ids:
+        return result
+
+    # One long table over all portfolios, with dates, tickers and portfolios as integer codes
+    frames = [holdings[portfolio_id] for portfolio_id in ids]
+    portfolio_codes = np.repeat(np.arange(len(ids)), [len(frame) for frame in frames])
+    date_codes, holding_dates = pd.factorize(np.concatenate([frame["Date"].to_numpy() for frame in frames]), sort=True)
+    holding_dates = format_dates(holding_dates)
+    ticker_codes, tickers = _symbol_codes([frame["Symbol"] for frame in frames])
+    shares = np.concatenate([frame["Shares"].to_numpy(dtype=float) for frame in frames])
+    order = np.argsort(date_codes, kind="stable")
+    date_codes, portfolio_codes, ticker_codes, shares = date_codes[order], portfolio_codes[order], ticker_codes[order], shares[order]
+
+    # Shared price columns for the union of tickers; unknown tickers and missing prices are 0
+    cols = np.array([prices.ticker_index.get(ticker, -1) for ticker in tickers], dtype=np.intp)
+    price_rows = np.zeros((len(prices.dates) + 1, len(tickers)))  # Last row: dates without prices
+    if prices.values.size:
+        price_rows[:-1] = np.nan_to_num(prices.values[:, np.maximum(cols, 0)])
+        price_rows[:, cols < 0] = 0.0
+
+    price_dates = np.asarray(prices.dates, dtype=object)
+    holding_dates = np.asarray(holding_dates, dtype=object)
+    if step_holdings:
+        starts = np.searchsorted(price_dates, holding_dates, side="left")
+        ends = np.append(starts[1:], len(price_dates))
+        dates = price_dates[starts[0]:]
+        spans = [np.arange(start, end) for start, end in zip(starts, ends)]
+    else:
+        dates = holding_dates
+        missing = len(prices.dates)
+        spans = [np.array([prices.date_index.get(date, missing)]) for date in holding_dates]
+
+    values = np.zeros((len(dates), len(ids)))
+    current = np.zeros((len(ids), len(tickers)))
+    bounds = np.searchsorted(date_codes, np.arange(len(holding_dates) + 1))
+    row = 0
+    for i, span in enumerate(spans):
+        changed = slice(bounds[i], bounds[i + 1])
+        # A holdings date replaces the portfolio's whole position list; repeated rows add up
+        current[np.unique(portfolio_codes[changed])] = 0.0
+        np.add.at(current, (portfolio_codes[changed], ticker_codes[changed]), shares[changed])
+        values[row:row + len(span)] = price_rows[span] @ current.T
+        row += len(span)
+
+    if step_holdings:
+        first_dates = np.full(len(ids), len(holding_dates))
+        np.minimum.at(first_dates, portfolio_codes, date_codes)
+        first_rows = np.searchsorted(dates, holding_dates[first_dates], side="left")
+        for k, portfolio_id in enumerate(ids):
+            result[portfolio_id] = (dates[first_rows[k]:].tolist(), values[first_rows[k]:, k])
+    else:
+        held = np.zeros((len(dates), len(ids)), dtype=bool)
+        held[date_codes, portfolio_codes] = True
+        for k, portfolio_id in enumerate(ids):
+            result[portfolio_id] = (dates[held[:, k]].tolist(), values[held[:, k], k])
+    return result
+
+
+def revalue_portfolio(previous, holdings: pd.DataFrame, prices: PriceMatrix, changed, step_holdings: bool = False):
+    """
+    Value one portfolio after some of its holdings dates changed, reusing every earlier value that
+    still holds.
+
+    A valuation date is recomputed only when the holdings date it is valued with (itself, or the
+    last holdings date before it with step_holdings) changed, or, with step_holdings, when that
+    holdings date's span grew or shrank because a later holdings date was added or removed.
+
+    Args:
+        previous: (dates, values) from before the change, against the same prices.
+        changed: Holdings dates that were added, removed or edited.
+
+    Returns:
+        tuple: (dates, values) like batch_portfolio_values.
+    """
+    holding_dates = np.asarray(sorted(set(format_dates(holdings["Date"].unique()))), dtype=object)
+    if not len(holding_dates):
+        return [], np.zeros(0)
+    changed = np.asarray(sorted(format_dates(changed)), dtype=object)
+    affected = set(changed) & set(holding_dates)
+    if step_holdings:
+        # The holdings date before each change now spans up to a different next date
+        before = np.searchsorted(holding_dates, changed, side="left") - 1
+        affected |= set(holding_dates[before[before >= 0]])
+        price_dates = np.asarray(prices.dates, dtype=object)
+        dates = price_dates[np.searchsorted(price_dates, holding_dates[0], side="left"):]
+        owners = holding_dates[np.searchsorted(holding_dates, dates, side="right") - 1]
+    else:
+        dates = owners = holding_dates
+
+    reuse = ~np.isin(owners, list(affected))
+    old = pd.Series(previous[1], index=pd.Index(previous[0], dtype=object))
+    reuse &= np.isin(dates, old.index)
+    values = np.zeros(len(dates))
+    values[reuse] = old.reindex(dates[reuse]).to_numpy()
+    if not reuse.all():
+        subset = holdings[holdings["Date"].isin(pd.to_datetime(sorted(affected | set(owners[~reuse])))).to_numpy()]
+        sub_dates, sub_values = batch_portfolio_values({0: subset}, prices, step_holdings)[0]
+        fresh = pd.Series(sub_values, index=pd.Index(sub_dates, dtype=object))
+        values[~reuse] = fresh.reindex(dates[~reuse]).to_numpy()
+    return dates.tolist(), values
+
+
+class ValuationBatch:
+    """
+    Valuations of many portfolios against the same price matrix.
+
+    Portfolio values for every portfolio come from one batch_portfolio_values pass; the per-cell
+    matrices behind trades and sector weights are only built for portfolios that ask for them.
+    """
+
+    def __init__(self, holdings: dict, prices: PriceMatrix, step_holdings: bool = False, version=None, values=None):
+        self.holdings = holdings
+        self.prices = prices
+        self.step_holdings = step_holdings
+        self.version = version
+        self.values = values if values is not None else batch_portfolio_values(holdings, prices, step_holdings)
+        self._valuations = {}
+        self._previous = {}
+        self._lock = threading.Lock()
+
+    def get(self, portfolio_id) -> Valuation:
+        with self._lock:
+            valuation = self._valuations.get(portfolio_id)
+            if valuation is None:
+                valuation = self._valuations[portfolio_id] = Valuation(
+                    self.holdings[portfolio_id], self.prices, self.step_holdings,
+                    portfolio_values=self.values[portfolio_id][1],
+                    previous=self._previous.pop(portfolio_id, None),
+                )
+            return valuation
+
+    def updated(self, holdings: dict, changes: dict, version=None):
+        """
+        A batch for a newer set of portfolios that recomputes only what changed.
+
+        Args:
+            changes: {portfolio_id: holdings dates that changed, or None to revalue
+                the portfolio from scratch}. Portfolios not listed are carried over as they are.
+        """
+        values, rebuild, revalue = {}, {}, {}
+        for portfolio_id, frame in holdings.items():
+            if portfolio_id not in changes:
+                values[portfolio_id] = self.values[portfolio_id]
+            elif changes[portfolio_id] is None or portfolio_id not in self.values:
+                rebuild[portfolio_id] = frame
+            else:
+                revalue[portfolio_id] = format_dates(changes[portfolio_id])
+        values.update(batch_portfolio_values(rebuild, self.prices, self.step_holdings) if rebuild else {})
+        for portfolio_id, changed in revalue.items():
+            values[portfolio_id] = revalue_portfolio(
+                self.values[portfolio_id], holdings[portfolio_id], self.prices, changed, self.step_holdings
+            )
+
+        batch = ValuationBatch(holdings, self.prices, self.step_holdings, version, values=values)
+        with self._lock:
+            for portfolio_id in values:
+                earlier = self._valuations.get(portfolio_id)
+                if portfolio_id not in changes and earlier is not None:
+                    batch._valuations[portfolio_id] = earlier
+                elif portfolio_id in revalue and earlier is not None and "trades" in earlier.__dict__:
+                    batch._previous[portfolio_id] = (earlier, revalue[portfolio_id])
+        return batch
+
+
+def filter_trades(trades: pd.DataFrame, tickers=None, start=None, end=None, trade_type=None) -> pd.DataFrame:
+    """
+    Filter a trade table by tickers, inclusive "YYYY-MM-DD" date bounds and BUY/SELL type.
+    Raises ValueError for dates that aren't ISO dates (they would compare wrongly as strings) or
+    an unknown type.
+    """
+    start = date.fromisoformat(start).isoformat() if start else None
+    end = date.fromisoformat(end).isoformat() if end else None
+    if trade_type and trade_type.upper() not in ("BUY", "SELL"):
+        raise ValueError(f"Unknown trade type {trade_type}, expected BUY or SELL")
+    mask = np.ones(len(trades), dtype=bool)
+    if tickers:
+        mask &= trades["Ticker"].isin(tickers).to_numpy()
+    if start:
+        mask &= (trades["Date"] >= start).to_numpy()
+    if end:
+        mask &= (trades["Date"] <= end).to_numpy()
+    if trade_type:
+        mask &= (trades["Type"] == trade_type.upper()).to_numpy()
+    return trades[mask]
+
+
+def encode_cursor(date: str, ticker: str) -> str:
+    return base64.urlsafe_b64encode(f"{date}|{ticker}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Return the (date, ticker) key a cursor points after. Raises ValueError on malformed cursors."""
+    try:
+        date, ticker = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+    return date, ticker
+
+
+def page_trades(trades: pd.DataFrame, limit: int, cursor: str = None):
+    """
+    Keyset-paginate trades ordered newest first (Date desc, Ticker asc).
+
+    Returns:
+        tuple: (page DataFrame, next cursor or None when this is the last page)
+    """
+    if cursor:
+        date, ticker = decode_cursor(cursor)
+        after = (trades["Date"] < date) | ((trades["Date"] == date) & (trades["Ticker"] > ticker))
+        trades = trades[after.to_numpy()]
+    page = trades.iloc[:limit]
+    if len(trades) <= limit:
+        return page, None
+    last = page.iloc[-1]
+    return page, encode_cursor(last["Date"], last["Ticker"])
@@ -0,0 +1,399 @@
+"""
+Offline benchmark harness for the backend.
+
+Generates a synthetic holdings file (N tickers x M months) and synthetic daily OHLCV history, serves
+them from in-process stand-ins for InfluxDB and yfinance, and measures:
+
+- ingestion throughput (fetch planning + bulk store) and price store build time,
+- latency distribution of every analytics endpoint, served from the snapshot, warm (cached
+  valuation) and cold (valuation rebuilt on each call),
+- batched valuation time across --portfolios portfolios sharing the same ticker universe, and the
+  time to score a batch of 100 weight scenarios,
+- peak traced memory per phase.
+
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmark.py --tickers 500 --months 120 --iterations 30 --output bench_results.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SECTORS = [
+    "Technology", "Healthcare", "Financial Services", "Consumer Cyclical", "Industrials", "Energy",
+    "Utilities", "Real Estate", "Basic Materials", "Communication Services", "Consumer Defensive",
+]
+ENDPOINTS = [
+    "/portfolio_value",
+    "/portfolio_performance",
+    "/sector_breakdown",
+    "/trades",
+    "/holdings",
+    "/sharpe_ratio",
+    "/risk_metrics",
+    "/portfolio_value?resolution=daily&max_points=500",
+    "/trades?limit=100",
+]
+
+
+def synthetic_tickers(n_tickers: int) -> list:
+    return [f"T{i:04d}" for i in range(n_tickers)]
+
+
+def synthetic_holdings(tickers: list, n_months: int, seed: int = 0) -> pd.DataFrame:
+    """Monthly holdings where each ticker is held ~80% of months with drifting share counts."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2015-01-01", periods=n_months, freq="MS")
+    held = rng.random((n_months, len(tickers))) < 0.8
+    shares = np.maximum(1, rng.integers(10, 500, len(tickers)) + rng.integers(-20, 21, (n_months, len(tickers))).cumsum(axis=0))
+    rows, cols = np.nonzero(held)
+    return pd.DataFrame({
+        "Date": dates[rows].strftime("%Y-%m-%d"),
+        "Symbol": np.asarray(tickers)[cols],
+        "Shares": shares[rows, cols],
+    })
+
+
+def synthetic_ohlcv(tickers: list, n_months: int, seed: int = 1) -> pd.DataFrame:
+    """Daily business-day OHLCV in yfinance's wide (Price, Ticker) layout, geometric random walks."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2014-12-01", pd.Timestamp("2015-01-01") + pd.DateOffset(months=n_months))
+    close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, (len(dates), len(tickers))), axis=0))
+    open_ = close * (1 + rng.normal(0, 0.005, close.shape))
+    volume = rng.integers(1_000, 1_000_000, close.shape).astype(float)
+    frames = {
+        "Close": pd.DataFrame(close, index=dates, columns=tickers),
+        "Open": pd.DataFrame(open_, index=dates, columns=tickers),
+        "Volume": pd.DataFrame(volume, index=dates, columns=tickers),
+    }
+    data = pd.concat(frames, axis=1)
+    data.columns.names = ["Price", "Ticker"]
+    return data
+
+
+class LocalYahoo:
+    """Stand-in for yf.download that slices the synthetic OHLCV frame."""
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+        self.calls = 0
+
+    def download(self, tickers, start=None, end=None, **kwargs):
+        self.calls += 1
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        data = self.data.loc[pd.Timestamp(start):]
+        if end is not None:
+            data = data[data.index < pd.Timestamp(end)]
+        return data.loc[:, data.columns.get_level_values(1).isin(tickers)]
+
+
+class LocalInflux:
+    """
+    In-memory stand-in for the InfluxDB write and query APIs, answering the queries db.py issues.
+
+    Writes keep the last value per (time, ticker) like InfluxDB does for the same series and timestamp.
+    """
+
+    def __init__(self):
+        self._frames = []
+        self._lock = threading.Lock()
+        self._wide = None
+        self.line_protocol_bytes = 0
+
+    def write(self, bucket=None, org=None, record=None, **kwargs):
+        # Serialize exactly as the real client would, so client-side encoding cost is measured
+        from influxdb_client.client.write.dataframe_serializer import data_frame_to_list_of_points
+        from influxdb_client.client.write_api import PointSettings
+
+        if isinstance(record, pd.DataFrame):
+            lines = data_frame_to_list_of_points(record, PointSettings(), **kwargs)
+            self.line_protocol_bytes += sum(len(line) for line in lines)
+            frame = record[["ticker", "close_price"]]
+        else:  # a single influxdb_client Point from the per-cell path
+            self.line_protocol_bytes += len(record.to_line_protocol())
+            frame = pd.DataFrame(
+                {"ticker": [record._tags["ticker"]], "close_price": [record._fields["close_price"]]},
+                index=pd.DatetimeIndex([record._time]),
+            )
+        with self._lock:
+            self._frames.append(frame)
+            self._wide = None
+
+    def _close_prices(self) -> pd.DataFrame:
+        with self._lock:
+            if self._wide is None:
+                if not self._frames:
+                    self._wide = pd.DataFrame(dtype=float)
+                else:
+                    long = pd.concat(self._frames)
+                    long.index = pd.DatetimeIndex(long.index).tz_localize(None)
+                    long = long.reset_index(names="_time").drop_duplicates(["_time", "ticker"], keep="last")
+                    self._wide = long.pivot(index="_time", columns="ticker", values="close_price").sort_index()
+            return self._wide
+
+    def query_data_frame(self, query, org=None, **kwargs):
+        from db import RESOLUTION_WINDOWS
+        from parquet_store import HISTORY_START, window_last
+
+        if "keep(columns" in query:  # bar dates for the gap check
+            wide = self._close_prices()
+            long = wide[wide.index >= HISTORY_START].stack().dropna().reset_index()
+            return pd.DataFrame({"_time": long["_time"].dt.tz_localize("UTC"), "ticker": long["ticker"]})
+
+        every = re.search(r"every: (\w+)", query).group(1)
+        resolution = {window: name for name, window in RESOLUTION_WINDOWS.items()}[every]
+        wide = self._close_prices()
+        wide = wide[wide.index >= HISTORY_START]
+        if wide.empty:
+            return pd.DataFrame()
+        frame = window_last(wide, resolution).reset_index(names="_time")
+        frame["_time"] = frame["_time"].dt.tz_localize("UTC")
+        frame.insert(0, "result", "_result")
+        frame.insert(1, "table", 0)
+        return frame
+
+    def query(self, query, org=None, **kwargs):
+        from influxdb_client.client.flux_table import FluxRecord, FluxTable
+
+        wide = self._close_prices()
+        depth = 2 if "limit(n: 2)" in query else 1
+        tables = []
+        for ticker in wide.columns:
+            series = wide[ticker].dropna()
+            table = FluxTable()
+            for timestamp, price in series.iloc[::-1][:depth].items():
+                table.records.append(FluxRecord(0, {"_time": timestamp, "ticker": ticker, "_value": price}))
+            tables.append(table)
+        return tables
+
+
+class Timer:
+    def __init__(self):
+        self.samples = []
+
+    def measure(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples.append(time.perf_counter() - started)
+        return result
+
+    def summary(self) -> dict:
+        ms = np.asarray(self.samples) * 1000
+        return {
+            "n": len(ms),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3),
+        }
+
+
+def peak_memory(fn, *args, **kwargs) -> float:
+    """Peak traced allocation in MiB while running fn once."""
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def install_stand_ins(db, influx: LocalInflux, yahoo: LocalYahoo):
+    db.query_api = influx
+    db.write_api = influx
+    db.bulk_write_api = influx
+    db.yf.download = yahoo.download
+    db.get_stock_sector = lambda ticker: SECTORS[int(hashlib.md5(ticker.encode()).hexdigest(), 16) % len(SECTORS)]
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="ssmif-bench-")
+    os.environ["DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["STORAGE_BACKEND"] = args.storage
+    sys.path.insert(0, BACKEND_DIR)
+
+    tickers = synthetic_tickers(args.tickers)
+    synthetic_holdings(tickers, args.months, args.seed).to_csv(os.path.join(workdir, "holdings.csv"), index=False)
+    ohlcv = synthetic_ohlcv(tickers + ["^GSPC"], args.months, args.seed + 1)
+
+    os.chdir(workdir)  # mains reads holdings.csv from the working directory at import
+    import db
+
+    influx, yahoo = LocalInflux(), LocalYahoo(ohlcv)
+    install_stand_ins(db, influx, yahoo)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": pd.Timestamp.now("UTC").isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "tickers": args.tickers,
+            "months": args.months,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "portfolios": args.portfolios,
+            "storage": args.storage,
+            "ohlcv_cells": int(ohlcv["Close"].size),
+        }
+    }
+
+    # Ingestion: fetch planning + bulk store into the local stand-in
+    started = time.perf_counter()
+    stats = db.update_stock_data(tickers)
+    results["ingestion"] = {
+        "seconds": round(time.perf_counter() - started, 3),
+        "store": stats,
+        "download_calls": yahoo.calls,
+        "line_protocol_bytes": influx.line_protocol_bytes,
+    }
+    if args.legacy_ingestion:
+        legacy = LocalInflux()
+        db.write_api = legacy
+        started = time.perf_counter()
+        db.store_stock_prices(ohlcv, bulk=False)
+        elapsed = time.perf_counter() - started
+        results["ingestion"]["legacy_seconds"] = round(elapsed, 3)
+        results["ingestion"]["legacy_rows_per_sec"] = round(int(ohlcv["Close"].notna().sum().sum()) / elapsed, 1)
+        db.write_api = influx
+
+    import mains
+    import ledger
+    import price_store
+    from fastapi.testclient import TestClient
+
+    build = Timer()
+    for _ in range(max(1, args.iterations // 10)):
+        build.measure(price_store.store.refresh)
+    results["price_store_refresh"] = build.summary()
+    results["price_store_refresh"]["peak_mib"] = peak_memory(price_store.store.refresh)
+    price_store.store.get("daily")
+
+    import price_gaps
+
+    gap_scan = Timer()
+    for _ in range(max(1, args.iterations // 10)):
+        gap_scan.measure(lambda: price_gaps.find_gaps(db.get_stock_bar_dates(), tickers + ["^GSPC"]))
+    results["gap_scan"] = gap_scan.summary()
+    mains.sectors.cache.populate(tickers)
+
+    # Extra portfolios over random subsets of the same universe share one batched valuation
+    rng = np.random.default_rng(args.seed)
+    for k in range(1, args.portfolios):
+        subset = sorted(rng.choice(tickers, size=max(1, len(tickers) // 2), replace=False))
+        mains.portfolios.registry.register(f"bench{k}", synthetic_holdings(subset, args.months, args.seed + k))
+    results["valuation_batch"] = {}
+    for resolution in ("monthly", "daily"):
+        timer = Timer()
+        for _ in range(max(1, args.iterations // 10)):
+            mains._valuations.clear()
+            timer.measure(mains.current_batch, resolution)
+        results["valuation_batch"][resolution] = timer.summary()
+
+    import scenarios
+
+    # Weight scenarios over random subsets, rebalanced quarterly, valued in this process
+    payload = {"scenarios": [
+        {"weights": {ticker: 1.0 for ticker in rng.choice(tickers, size=max(1, len(tickers) // 5), replace=False)},
+         "rebalance": "quarterly"}
+        for _ in range(100)
+    ]}
+    specs = scenarios.parse_scenarios(payload, {})
+    context = {
+        "resolution": "monthly", "prices": price_store.store.get("monthly"), "monthly": price_store.store.get("monthly"),
+        "periods_per_year": 12, "risk_free_rate": 0.0, "series": False,
+    }
+    timer = Timer()
+    for _ in range(max(1, args.iterations // 10)):
+        timer.measure(scenarios.run, specs, context, 1)
+    results["scenarios_100"] = timer.summary()
+
+    started = time.perf_counter()
+    mains.materialize_snapshot()
+    results["materialize_seconds"] = round(time.perf_counter() - started, 3)
+
+    def clear_caches():
+        mains._valuations.clear()
+        mains._risk_cache.clear()
+        ledger._ledgers.clear()
+
+    client = TestClient(mains.app)  # not entered, so the startup ingestion/scheduler don't run
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        separator = "&" if "?" in endpoint else "?"
+        bypass = f"{endpoint}{separator}_bench=1"  # Any query string bypasses the snapshot
+        modes = {"warm": (bypass, None), "cold": (bypass, clear_caches)}
+        if "?" not in endpoint:
+            modes["snapshot"] = (endpoint, None)
+
+        endpoints[endpoint] = {}
+        for mode, (url, before) in modes.items():
+            timer = Timer()
+            client.get(url)  # warm-up
+            for _ in range(args.iterations):
+                if before:
+                    before()
+                response = timer.measure(client.get, url)
+                response.raise_for_status()
+            summary = timer.summary()
+            summary["bytes"] = len(response.content)
+            endpoints[endpoint][mode] = summary
+        clear_caches()
+        endpoints[endpoint]["cold"]["peak_mib"] = peak_memory(client.get, f"{endpoint}{separator}_bench=1")
+    results["endpoints"] = endpoints
+
+    try:
+        import resource
+
+        results["max_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", type=int, default=200, help="Number of synthetic tickers")
+    parser.add_argument("--months", type=int, default=120, help="Number of monthly holdings snapshots")
+    parser.add_argument("--iterations", type=int, default=20, help="Requests per endpoint and mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--portfolios", type=int, default=1, help="Number of portfolios sharing the price data")
+    parser.add_argument(
+        "--storage", choices=["influxdb", "parquet"], default="influxdb",
+        help="Price storage: the in-memory InfluxDB stand-in or the embedded Parquet store in the temp dir",
+    )
+    parser.add_argument("--legacy-ingestion", action="store_true", help="Also time the per-point ingestion path")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = run(args)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({"ingestion": results["ingestion"], "output": output}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,22 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import warnings
 from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
 from urllib3 import Retry
 import yfinance as yf
 from influxdb_client import InfluxDBClient, Point, WriteOptions
+from influxdb_client.client.write_api import SYNCHRONOUS
 import requests
 
 from datetime import datetime, timedelta
 import os
 import logging
+import threading
+import time
+
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -28,50 +35,413 @@ INFLUXDB_BUCKET = os.getenv("INFLUXDB_BUCKET", "null")
 client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
 query_api = client.query_api()
 write_api = client.write_api(write_options=WriteOptions(batch_size=500, flush_interval=10000))
+# Bulk ingestion writes whole chunks synchronously so failures can be counted per chunk
+bulk_write_api = client.write_api(write_options=SYNCHRONOUS)
+BULK_CHUNK_SIZE = int(os.getenv("INFLUXDB_BULK_CHUNK_SIZE", "50000"))
 
 # CSV file location
 holdings_file = "holdings.csv"
 
-def get_latest_stock_date():
-    """Query InfluxDB to find the most recent stock data date, ensuring it does not return a future date."""
-    
-    query = f'''
+# Flux window for each supported time-series resolution
+RESOLUTION_WINDOWS = {"daily": "1d", "weekly": "1w", "monthly": "1mo"}
+
+# Directory for locally persisted state (ledgers, caches)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Where price history lives: "influxdb" (default) or "parquet" for the embedded local store
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "influxdb")
+PARQUET_STORE_DIR = os.getenv("PARQUET_STORE_DIR", os.path.join(DATA_DIR, "prices"))
+
+# Fetch planning: earliest history to backfill, and how tickers are grouped into yf.download calls
+DEFAULT_START_DATE = "2015-01-01"
+FETCH_CHUNK_SIZE = int(os.getenv("FETCH_CHUNK_SIZE", "50"))
+FETCH_GROUP_DAYS = int(os.getenv("FETCH_GROUP_DAYS", "7"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "4"))
+
+class IngestionProgress:
+    """Thread-safe record of the current (or last) ingestion run, readable from request handlers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {
+            "state": "idle",
+            "phase": None,
+            "started_at": None,
+            "finished_at": None,
+            "chunks_total": 0,
+            "chunks_done": 0,
+            "rows_written": 0,
+            "stats": None,
+            "error": None,
+            "completed_runs": 0,
+        }
+
+    def start(self):
+        self.update(
+            state="running", phase="planning", started_at=datetime.utcnow().isoformat(), finished_at=None,
+            chunks_total=0, chunks_done=0, rows_written=0, stats=None, error=None,
+        )
+
+    def finish(self, stats=None, error=None):
+        with self._lock:
+            self._state.update(
+                state="failed" if error else "done", phase=None, finished_at=datetime.utcnow().isoformat(),
+                stats=stats, error=error, completed_runs=self._state["completed_runs"] + 1,
+            )
+
+    def update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def increment(self, field: str, amount: int = 1):
+        with self._lock:
+            self._state[field] += amount
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._state)
+
+ingestion_progress = IngestionProgress()
+
+class InfluxStorage:
+    """
+    Price history in the InfluxDB "stock_prices" measurement (the default backend).
+
+    Storage backends share this interface: latest_dates(), write(long_frame), latest_prices(tickers),
+    prices_for_date(date), price_frame(resolution) and bar_dates(). The public functions below dispatch to the
+    configured backend, so callers never talk to a backend directly.
+    """
+
+    name = "influxdb"
+
+    def latest_dates(self) -> dict:
+        query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: -15y)
+            |> filter(fn: (r) => r["_measurement"] == "stock_prices")
+            |> filter(fn: (r) => r["_field"] == "close_price")
+            |> group(columns: ["ticker"])
+            |> last()
+        '''
+        with metrics.timer(metrics.INFLUX_QUERY_SECONDS, span="influx", query="get_latest_stock_dates"):
+            result = query_api.query(org=INFLUXDB_ORG, query=query)
+
+        today = datetime.utcnow().date()
+        watermarks = {}
+        for table in result:
+            for record in table.records:
+                date = record.get_time().date()
+                if date <= today:
+                    watermarks[record.values["ticker"]] = date.strftime('%Y-%m-%d')
+        return watermarks
+
+    def write(self, chunk: pd.DataFrame):
+        """Write rows from stock_frame_to_long (indexed by _time) in one synchronous request."""
+        bulk_write_api.write(
+            bucket=INFLUXDB_BUCKET,
+            org=INFLUXDB_ORG,
+            record=chunk,
+            data_frame_measurement_name="stock_prices",
+            data_frame_tag_columns=["ticker"],
+        )
+
+    def latest_prices(self, tickers=None) -> dict:
+        ticker_filter = ""
+        if tickers is not None:
+            ticker_set = ", ".join(f'"{ticker}"' for ticker in tickers)
+            ticker_filter = f'|> filter(fn: (r) => contains(value: r["ticker"], set: [{ticker_set}]))'
+        query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: -1mo)  // Adjust time range if needed
+            |> filter(fn: (r) => r["_measurement"] == "stock_prices")
+            |> filter(fn: (r) => r["_field"] == "close_price")
+            {ticker_filter}
+            |> group(columns: ["ticker"])  // Group by ticker
+            |> sort(columns: ["_time"], desc: true)  // Sort in descending order (latest first)
+            |> limit(n: 2)  // Get the latest 2 prices per ticker
+        '''
+        with metrics.timer(metrics.INFLUX_QUERY_SECONDS, span="influx", query="fetch_latest_prices"):
+            result = query_api.query(org=INFLUXDB_ORG, query=query)
+
+        latest_prices = defaultdict(dict)
+        for table in result:
+            for i, record in enumerate(table.records):
+                ticker = record.values["ticker"]
+                price = record.values["_value"]
+                if i == 0:
+                    latest_prices[ticker]["close"] = price
+                if i == 1:
+                    latest_prices[ticker]["prev_close"] = price
+        return latest_prices
+
+    def prices_for_date(self, target_date: str) -> dict:
+        query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: {target_date})
+            |> filter(fn: (r) => r["_measurement"] == "stock_prices")
+            |> filter(fn: (r) => r["_field"] == "close_price")
+            |> sort(columns: ["_time"], desc: false)
+            |> limit(n: 1)
+        '''
+        with metrics.timer(metrics.INFLUX_QUERY_SECONDS, span="influx", query="get_stock_prices_for_date"):
+            result = query_api.query(org=INFLUXDB_ORG, query=query)
+
+        stock_prices = {}
+        for table in result:
+            for record in table.records:
+                stock_prices[record.values["ticker"]] = record.values["_value"]
+        return stock_prices
+
+    def price_frame(self, resolution: str) -> pd.DataFrame:
+        """
+        Windowing and pivoting run inside InfluxDB, and the single result table is decoded straight
+        into pandas columns through the client's streaming CSV parser, so no per-record objects are built.
+        """
+        every = RESOLUTION_WINDOWS[resolution]
+        query = f'''
         from(bucket: "{INFLUXDB_BUCKET}")
-        |> range(start: -15y)
-        |> filter(fn: (r) => r["_measurement"] == "stock_prices")
-        |> last()
+            |> range(start: 2014-12-31T00:00:00Z)
+            |> filter(fn: (r) => r["_measurement"] == "stock_prices")
+            |> filter(fn: (r) => r["_field"] == "close_price")
+            |> aggregateWindow(every: {every}, fn: last, createEmpty: false)
+            |> group()
+            |> pivot(rowKey: ["_time"], columnKey: ["ticker"], valueColumn: "_value")
+            |> drop(columns: ["_start", "_stop", "_field", "_measurement"])
+            |> sort(columns: ["_time"])
     '''
-    result = query_api.query(org=INFLUXDB_ORG, query=query)
-
-    latest_date = None
-    for table in result:
-        for record in table.records:
-            date = record.get_time().date()  # Get the date only (no time component)
-            yesterday = datetime.utcnow().date()
-            if date <= yesterday:
-                latest_date = date.strftime('%Y-%m-%d')
-    print("last seen date in DB: ", latest_date)
-    return latest_date if latest_date else "2015-01-01"  # Default to earliest date
+        with metrics.timer(metrics.INFLUX_QUERY_SECONDS, span="influx", query="get_stock_price_frame"):
+            frame = query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
+        if isinstance(frame, list):
+            frame = pd.concat(frame, ignore_index=True) if frame else pd.DataFrame()
+        if frame.empty:
+            return pd.DataFrame(dtype=float)
+
+        frame = frame.drop(columns=["result", "table"], errors="ignore")
+        frame.index = pd.to_datetime(frame.pop("_time"), utc=True).dt.strftime("%Y-%m-%d").to_numpy()
+        return frame.astype(float).sort_index(axis=1)
+
+    def bar_dates(self) -> dict:
+        query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: 2014-12-31T00:00:00Z)
+            |> filter(fn: (r) => r["_measurement"] == "stock_prices")
+            |> filter(fn: (r) => r["_field"] == "close_price")
+            |> keep(columns: ["_time", "ticker"])
+            |> group()
+    '''
+        with metrics.timer(metrics.INFLUX_QUERY_SECONDS, span="influx", query="get_stock_bar_dates"):
+            frame = query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
+        if isinstance(frame, list):
+            frame = pd.concat(frame, ignore_index=True) if frame else pd.DataFrame()
+        if frame.empty:
+            return {}
+        times = pd.to_datetime(frame["_time"], utc=True).dt.tz_localize(None)
+        return group_bar_dates(frame["ticker"], times)
+
+def group_bar_dates(tickers: pd.Series, times: pd.Series) -> dict:
+    """{ticker: sorted unique datetime64[D] array} from parallel ticker and timestamp columns."""
+    days = pd.Series(times.to_numpy().astype("datetime64[D]"), index=tickers.to_numpy())
+    # pandas may widen datetime64[D] to seconds inside a Series, so cast the unique days back
+    return {ticker: np.unique(group.to_numpy()).astype("datetime64[D]") for ticker, group in days.groupby(level=0)}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """The price storage selected by STORAGE_BACKEND, created on first use."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == "parquet":
+                # Imported lazily so InfluxDB deployments don't need pyarrow
+                from parquet_store import ParquetStorage
+
+                _storage = ParquetStorage(PARQUET_STORE_DIR)
+            elif STORAGE_BACKEND == "influxdb":
+                _storage = InfluxStorage()
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+            logger.info(f"Using {_storage.name} price storage.")
+        return _storage
+
+def get_latest_stock_dates():
+    """
+    High-water mark of every ticker in the configured storage.
+
+    Returns:
+        dict: {ticker: "YYYY-MM-DD"} with the last stored bar per ticker (never a future date).
+    """
+    return get_storage().latest_dates()
+
+def plan_stock_fetch(tickers: list[str], watermarks: dict, today=None):
+    """
+    Group tickers into download chunks that share a similar start date.
+
+    Each ticker starts at its own watermark (re-fetching the last stored bar so a partial bar
+    gets overwritten) or the day before DEFAULT_START_DATE when it has no history. Tickers are sorted by start
+    date and packed into chunks of at most FETCH_CHUNK_SIZE whose starts lie within
+    FETCH_GROUP_DAYS of each other; a chunk downloads from its earliest start.
+
+    Returns:
+        list: [(start_date "YYYY-MM-DD", [tickers])] sorted by start date.
+    """
+    today = today or datetime.utcnow().date()
+    starts = []
+    for ticker in tickers:
+        if watermarks.get(ticker):
+            start = datetime.strptime(watermarks[ticker], '%Y-%m-%d').date()
+            if start >= today:
+                continue  # Already up to date
+        else:
+            # One day early so the 2014-12-31 bar, which prices the first holdings month, is stored
+            start = datetime.strptime(DEFAULT_START_DATE, '%Y-%m-%d').date() - timedelta(days=1)
+        starts.append((start, ticker))
+    starts.sort()
+
+    plan = []
+    for start, ticker in starts:
+        if (
+            plan
+            and len(plan[-1][1]) < FETCH_CHUNK_SIZE
+            and (start - plan[-1][0]).days <= FETCH_GROUP_DAYS
+        ):
+            plan[-1][1].append(ticker)
+        else:
+            plan.append((start, [ticker]))
+    return [(start.strftime('%Y-%m-%d'), chunk) for start, chunk in plan]
+
+def _download_chunk(start_date: str, tickers: list[str], end_date: str = None):
+    """
+    Download one planned chunk (up to end_date, exclusive, if given), always returning
+    (Price, Ticker) MultiIndex columns.
+    """
+    with metrics.timer(metrics.YF_FETCH_SECONDS, span="yfinance"):
+        data = yf.download(
+            tickers, start=start_date, end=end_date, session=session, group_by="column", progress=False,
+            threads=False,
+        )
+    if data is None or data.empty:
+        return None
+    if not isinstance(data.columns, pd.MultiIndex):
+        data.columns = pd.MultiIndex.from_product([data.columns, tickers])
+    return data
 
 def fetch_stock_data(tickers: list[str]):
-    """Fetch stock data from Yahoo Finance starting from the latest stored date."""
+    """
+    Fetch only the missing bars from Yahoo Finance, per ticker.
+
+    Tickers are planned into chunks by their own watermark (see plan_stock_fetch) and the chunks
+    are downloaded concurrently on a bounded worker pool sharing the pooled session.
+    """
+    tickers = list(tickers)
     if "^GSPC" not in tickers:
         tickers.append("^GSPC")
-    start_date = datetime.strptime(get_latest_stock_date(), '%Y-%m-%d') - timedelta(days=1)
-    logger.info(f"Fetching stock data from {start_date.strftime('%Y-%m-%d')} for {len(tickers)} tickers...")
-    
-    try:
-        data = yf.download(tickers, start=start_date.strftime('%Y-%m-%d'), session=session)
-        return data
-    except Exception as e:
-        logger.error(f"Error fetching data: {e}")
+    plan = plan_stock_fetch(tickers, get_latest_stock_dates())
+    if not plan:
+        logger.info("All tickers are up to date, nothing to fetch.")
+        return None
+    ingestion_progress.update(phase="fetching", chunks_total=len(plan))
+    logger.info(
+        f"Fetching stock data for {sum(len(c) for _, c in plan)} tickers in {len(plan)} chunks "
+        f"(earliest start {plan[0][0]})..."
+    )
+
+    frames = []
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = {executor.submit(_download_chunk, start, chunk): (start, chunk) for start, chunk in plan}
+        for future in as_completed(futures):
+            start, chunk = futures[future]
+            try:
+                data = future.result()
+                if data is not None:
+                    frames.append(data)
+            except Exception as e:
+                metrics.YF_FETCH_ERRORS.inc()
+                logger.error(f"Error fetching {len(chunk)} tickers from {start}: {e}")
+            ingestion_progress.increment("chunks_done")
+
+    if not frames:
         return None
+    return pd.concat(frames, axis=1).sort_index()
 
-def store_stock_prices(data: pd.DataFrame):
-    """Store stock prices in InfluxDB."""
+def stock_frame_to_long(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Flatten the wide yfinance frame (Close/Open/Volume x ticker columns) into one row per
+    (date, ticker) in a single vectorized pass. Cells without a close price are dropped.
+    """
+    close = data["Close"]
+    tickers = close.columns
+    n_dates, n_tickers = close.shape
+
+    long = pd.DataFrame(
+        {
+            "ticker": np.tile(tickers.to_numpy(dtype=object), n_dates),
+            "close_price": close.to_numpy(dtype=float).ravel(),
+            "open_price": data["Open"].reindex(columns=tickers).to_numpy(dtype=float).ravel(),
+            "volume": data["Volume"].reindex(columns=tickers).to_numpy(dtype=float).ravel(),
+        },
+        index=pd.DatetimeIndex(np.repeat(close.index.to_numpy(), n_tickers), name="_time"),
+    )
+    long = long[long["close_price"].notna()]
+    long["volume"] = long["volume"].fillna(0).astype("int64")
+    return long
+
+def store_stock_prices_bulk(data: pd.DataFrame, chunk_size: int = BULK_CHUNK_SIZE):
+    """
+    Store stock prices by writing large DataFrame chunks to the configured storage instead of one
+    point per cell.
+
+    Returns:
+        dict: {"rows": written, "skipped": cells without a close price, "rejected": rows in failed
+        chunks, "seconds": elapsed, "rows_per_sec": throughput}
+    """
+    started = time.perf_counter()
+    ingestion_progress.update(phase="storing")
+    long = stock_frame_to_long(data)
+    skipped = data["Close"].size - len(long)
+    written = rejected = 0
+    storage = get_storage()
+
+    for start in range(0, len(long), chunk_size):
+        chunk = long.iloc[start:start + chunk_size]
+        try:
+            storage.write(chunk)
+            written += len(chunk)
+            ingestion_progress.increment("rows_written", len(chunk))
+        except Exception as e:
+            rejected += len(chunk)
+            metrics.INGEST_ERRORS.inc()
+            logger.error(f"Error storing chunk of {len(chunk)} rows starting {chunk.index[0]}: {e}")
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "rows": written,
+        "skipped": int(skipped),
+        "rejected": rejected,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(written / elapsed, 1) if elapsed > 0 else float(written),
+    }
+    metrics.INGEST_ROWS.inc(written, result="written")
+    metrics.INGEST_ROWS.inc(rejected, result="rejected")
+    metrics.INGEST_ROWS.inc(stats["skipped"], result="skipped")
+    metrics.INGEST_ROWS_PER_SEC.set(stats["rows_per_sec"])
+    logger.info(
+        f"Stored {written} rows in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec), "
+        f"{rejected} rejected, {stats['skipped']} empty cells skipped."
+    )
+    return stats
+
+def store_stock_prices(data: pd.DataFrame, bulk: bool = True):
+    """
+    Store stock prices. Uses chunked bulk writes unless bulk=False, which keeps the original
+    per-point InfluxDB path (InfluxDB storage only).
+    """
     if data is None or data.empty:
         logger.warning("No stock data to store.")
-        return
+        return None
+
+    if bulk or not isinstance(get_storage(), InfluxStorage):
+        return store_stock_prices_bulk(data)
 
     logger.info(f"Storing stock data with {len(data)} rows in InfluxDB. This may take a while....")
     
@@ -92,129 +462,65 @@ def store_stock_prices(data: pd.DataFrame):
                     )
                     write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=point)
             except Exception as e:
+                metrics.INGEST_ERRORS.inc()
                 logger.error(f"Error storing data for {ticker} on {date}: {e}")
+    return None
 
 def update_stock_data(tickers):
-    """Fetch and store stock data synchronously."""
-
-    data = fetch_stock_data(tickers)
-    store_stock_prices(data)
+    """Fetch and store stock data synchronously, recording progress in ingestion_progress."""
+    ingestion_progress.start()
+    try:
+        data = fetch_stock_data(tickers)
+        stats = store_stock_prices(data)
+    except Exception as e:
+        ingestion_progress.finish(error=str(e))
+        raise
+    ingestion_progress.finish(stats=stats)
     logger.info("✅ Stock data ingestion completed.")
+    return stats
 
-def fetch_latest_prices():
-    """Fetch latest and previous day's closing prices from InfluxDB."""
-    today = datetime.utcnow().date()
-    yesterday = today - timedelta(days=1)
-
-    query = f'''
-        from(bucket: "{INFLUXDB_BUCKET}")
-        |> range(start: -1mo)  // Adjust time range if needed
-        |> filter(fn: (r) => r["_measurement"] == "stock_prices")
-        |> filter(fn: (r) => r["_field"] == "close_price")
-        |> group(columns: ["ticker"])  // Group by ticker
-        |> sort(columns: ["_time"], desc: true)  // Sort in descending order (latest first)
-        |> limit(n: 2)  // Get the latest 2 prices per ticker
-    '''
-    
-    result = query_api.query(org=INFLUXDB_ORG, query=query)
-    
-    latest_prices = defaultdict(dict)
-    # latest prices = {ticker: {"open": , "prev_open": }}
-    
-    for table in result:
-        # print(table.records)
-        for i, record in enumerate(table.records):
-            # print(record.values)
-            ticker = record.values["ticker"]
-            price = record.values["_value"]
-            if i == 0:
-                latest_prices[ticker]["close"] = price
-            if i == 1:
-                latest_prices[ticker]["prev_close"] = price
-    return latest_prices
-            
-    
-
-
+def fetch_latest_prices(tickers=None):
+    """
+    Latest and previous closing price per ticker as {ticker: {"close": , "prev_close": }}, for the
+    given tickers or all of them.
+    """
+    return get_storage().latest_prices(tickers)
 
 def get_stock_prices_for_date(target_date: str):
     """
     Fetch closing prices for all stocks in the database for a specific date.
-    If no exact match is found, it retrieves the closest available prices before the date.
-    
+
     Args:
         target_date (str): The date in "YYYY-MM-DD" format.
-        
+
     Returns:
-        dict: A dictionary of {ticker: closing_price} pairs.
+        dict: A dictionary of {ticker: closing_price} pairs, taking each ticker's first close on or
+        after the date.
     """
-    query = f'''
-        from(bucket: "{INFLUXDB_BUCKET}")
-        |> range(start: {target_date})
-        |> filter(fn: (r) => r["_measurement"] == "stock_prices")
-        |> filter(fn: (r) => r["_field"] == "close_price")
-        |> sort(columns: ["_time"], desc: false)
-        |> limit(n: 1)
-    '''
-    
-    result = query_api.query(org=INFLUXDB_ORG, query=query)
+    return get_storage().prices_for_date(target_date)
 
-    stock_prices = {}
-    for table in result:
-        for record in table.records:
-            ticker = record.values["ticker"]
-            price = record.values["_value"]
-            stock_prices[ticker] = price  # Store in dictionary {ticker: price}
-    return stock_prices  # Return all stock prices for the given date
+def get_stock_bar_dates():
+    """
+    Dates of every stored daily bar.
+
+    Returns:
+        dict: {ticker: sorted numpy datetime64[D] array}
+    """
+    return get_storage().bar_dates()
+
+def get_stock_price_frame(resolution: str = "monthly") -> pd.DataFrame:
+    """
+    Closing prices for every ticker at the end of each daily, weekly or monthly window, as one
+    dates x tickers DataFrame.
+
+    Returns:
+        DataFrame indexed by "YYYY-MM-DD" (window stop, as in the monthly series) with one float
+        column per ticker and NaN where a ticker has no price.
+    """
+    if resolution not in RESOLUTION_WINDOWS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    return get_storage().price_frame(resolution)
 
-def get_monthly_stock_prices():
-    
-    query = f'''
-    from(bucket: "{INFLUXDB_BUCKET}")
-        |> range(start: 2014-12-31T00:00:00Z)
-        |> filter(fn: (r) => r["_measurement"] == "stock_prices")
-        |> filter(fn: (r) => r["_field"] == "close_price")
-        |> sort(columns: ["_time"], desc: false) 
-        |> aggregateWindow(every: 1mo, fn: last, createEmpty: true)
-'''
-    result = query_api.query(org=INFLUXDB_ORG, query=query)
-
-    stock_prices = {}
-
-    for table in result:
-        for record in table.records:
-            date = record.get_time().strftime("%Y-%m-%d")  # Convert timestamp to date
-            ticker = record.values["ticker"]  # Extract ticker
-            price = record.values["_value"]   # Extract stock price
-            if price is None:
-                continue
-            if date not in stock_prices:
-                stock_prices[date] = {}
-            
-            stock_prices[date][ticker] = price  # Store data in dictionary
-    return stock_prices
-
-def get_monthly_SP_prices():
-    
-    query = f'''
-from(bucket: "{INFLUXDB_BUCKET}")
-  |> range(start: 2014-12-31T00:00:00Z)
-  |> filter(fn: (r) => r["_measurement"] == "stock_prices")
-  |> filter(fn: (r) => r["_field"] == "close_price")
-  |> filter(fn: (r) => r["ticker"] == "^GSPC")
-  |> sort(columns: ["_time"], desc: false) 
-  |> aggregateWindow(every: 1mo, fn: last, createEmpty: true)'''
-    result = query_api.query(org=INFLUXDB_ORG, query=query)
-
-    stock_prices = {}
-
-    for table in result:
-        for record in table.records:
-            date = record.get_time().strftime("%Y-%m-%d")  # Convert timestamp to date
-            price = record.values["_value"]   # Extract stock price            
-            stock_prices[date] = price  # Store data in dictionary
-    return stock_prices
-    
 def get_stock_sector(ticker):
     """
     Fetch the sector classification of a stock from Yahoo Finance.
@@ -0,0 +1,44 @@
+"""
+Shape-preserving downsampling for chart series (Largest-Triangle-Three-Buckets).
+"""
+import numpy as np
+import pandas as pd
+
+
+def lttb(y, threshold: int, x=None) -> np.ndarray:
+    """
+    Pick `threshold` indices of y that keep the visual shape of the series.
+
+    The first and last points are always kept; every bucket in between contributes the point forming
+    the largest triangle with the previously kept point and the next bucket's average.
+    """
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    indices[-1] = n - 1
+    return indices
+
+
+def downsample_records(records: list, max_points: int, value_key: str, date_key: str = "date") -> list:
+    """Downsample a list of {date, value} dicts to at most max_points using LTTB on value_key."""
+    if not max_points or len(records) <= max_points:
+        return records
+    x = pd.to_datetime([record[date_key] for record in records]).to_numpy().astype("datetime64[D]").astype(float)
+    y = [record[value_key] for record in records]
+    return [records[i] for i in lttb(y, max_points, x)]
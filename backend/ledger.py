@@ -0,0 +1,233 @@
+"""
+Persistent lot ledger for cost basis and P&L.
+
+Trades are applied incrementally: the ledger remembers the last trade date it has seen and only
+applies newer trades on each sync. Open lots are kept per ticker in a deque and consumed from the
+front (FIFO), the back (LIFO), or pooled into a single averaged lot (average cost).
+
+A digest of every applied date's trades detects edits to earlier months. Positions are checkpointed
+after each date (copy-on-write, in memory), so an edit only replays the trades from the changed
+date on.
+"""
+from collections import deque
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+
+import db
+import portfolios
+
+logger = logging.getLogger(__name__)
+
+COST_BASIS_METHODS = ("fifo", "lifo", "average")
+EPSILON = 1e-9
+
+
+class Position:
+    """Open lots plus running totals for one ticker."""
+
+    def __init__(self, lots=(), realized: float = 0.0):
+        self.lots = deque([list(lot) for lot in lots])
+        self.shares = sum(quantity for quantity, _ in self.lots)
+        self.cost = sum(quantity * price for quantity, price in self.lots)
+        self.realized = realized
+
+    def copy(self):
+        position = Position(self.lots, self.realized)
+        position.shares, position.cost = self.shares, self.cost
+        return position
+
+    @property
+    def unit_cost(self):
+        return self.cost / self.shares if self.shares > EPSILON else 0.0
+
+
+def ledger_path(method: str, portfolio_id: str = portfolios.DEFAULT_PORTFOLIO) -> str:
+    # The default portfolio keeps the file name from before portfolios had ids
+    if portfolio_id == portfolios.DEFAULT_PORTFOLIO:
+        return os.path.join(db.DATA_DIR, f"ledger_{method}.json")
+    return os.path.join(db.DATA_DIR, f"ledger_{portfolio_id}_{method}.json")
+
+
+def trade_digests(trades: pd.DataFrame) -> dict:
+    """{date: digest of that date's trades}, independent of row order within a date."""
+    if trades.empty:
+        return {}
+    hashes = pd.util.hash_pandas_object(trades[["Ticker", "Type", "Quantity", "UnitPrice"]], index=False)
+    return {date: int(digest) for date, digest in hashes.groupby(trades["Date"].to_numpy()).sum().items()}
+
+
+class LotLedger:
+    def __init__(self, method: str = "fifo", path: str = None):
+        if method not in COST_BASIS_METHODS:
+            raise ValueError(f"Unknown cost basis method {method!r}, expected one of {COST_BASIS_METHODS}")
+        self.method = method
+        self.path = path or ledger_path(method)
+        self._lock = threading.Lock()
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.positions = {}
+        self.watermark = None  # Date of the last applied trade
+        self.digests = {}  # Date -> digest of the trades applied on that date
+        self._checkpoints = {}  # Date -> positions after that date; never mutated once taken
+        self._copied = set()  # Tickers whose position was copied since the last checkpoint
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable ledger state {self.path}: {e}")
+            return
+        if state.get("method") != self.method or "digests" not in state:
+            return
+        self.watermark = state["watermark"]
+        self.digests = state["digests"]
+        self.positions = {
+            ticker: Position(p["lots"], p["realized"]) for ticker, p in state["positions"].items()
+        }
+        if self.watermark is not None:
+            self._checkpoint(self.watermark)
+
+    def save(self):
+        state = {
+            "method": self.method,
+            "watermark": self.watermark,
+            "digests": self.digests,
+            "positions": {
+                ticker: {"lots": list(p.lots), "realized": p.realized} for ticker, p in self.positions.items()
+            },
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def sync(self, trades: pd.DataFrame):
+        """
+        Apply trades newer than the watermark. trades must be in chronological order.
+
+        If trades up to the watermark no longer match what was applied (e.g. the holdings file was
+        edited), the ledger rewinds to the checkpoint before the first changed date and replays
+        from there, or rebuilds from scratch when no such checkpoint is in memory.
+        """
+        with self._lock:
+            incoming = trade_digests(trades)
+            applied_dates = set(self.digests)
+            if self.watermark is not None:
+                applied_dates |= {date for date in incoming if date <= self.watermark}
+            changed = [date for date in applied_dates if self.digests.get(date) != incoming.get(date)]
+            if changed:
+                self._rewind(min(changed))
+
+            dates = trades["Date"].to_numpy()
+            new_trades = trades[dates > self.watermark] if self.watermark is not None else trades
+            if new_trades.empty:
+                if changed:
+                    self.save()
+                return 0
+            current = None
+            for trade in new_trades.to_dict("records"):
+                if trade["Date"] != current:
+                    if current is not None:
+                        self._checkpoint(current)
+                    current = trade["Date"]
+                self._apply(trade["Ticker"], trade["Type"], trade["Quantity"], trade["UnitPrice"])
+            self._checkpoint(current)
+            self.watermark = current
+            self.digests.update({date: incoming[date] for date in new_trades["Date"].unique()})
+            self.save()
+            return len(new_trades)
+
+    def _checkpoint(self, date):
+        self._checkpoints[date] = dict(self.positions)
+        self._copied = set()
+
+    def _rewind(self, date):
+        """Restore the positions from before `date`, forgetting everything applied since."""
+        earlier = [checkpoint for checkpoint in self._checkpoints if checkpoint < date]
+        if not earlier:
+            if any(applied < date for applied in self.digests):
+                logger.info(f"Trade history changed on {date}, rebuilding {self.method} ledger.")
+            self.reset()
+            return
+        restore = max(earlier)
+        logger.info(f"Trade history changed on {date}, replaying {self.method} ledger from {restore}.")
+        self.positions = dict(self._checkpoints[restore])
+        self.watermark = restore
+        self.digests = {applied: digest for applied, digest in self.digests.items() if applied <= restore}
+        self._checkpoints = {checkpoint: positions for checkpoint, positions in self._checkpoints.items() if checkpoint <= restore}
+        self._copied = set()
+
+    def _apply(self, ticker, trade_type, quantity, unit_price):
+        position = self.positions.get(ticker)
+        if position is None:
+            position = self.positions[ticker] = Position()
+        elif ticker not in self._copied:
+            # The current object may belong to a checkpoint, so mutate a copy
+            position = self.positions[ticker] = position.copy()
+        self._copied.add(ticker)
+        if trade_type == "BUY":
+            position.shares += quantity
+            position.cost += quantity * unit_price
+            if self.method == "average" and position.lots:
+                # Pool everything into one lot at the running average cost
+                position.lots[0] = [position.shares, position.cost / position.shares]
+            else:
+                position.lots.append([quantity, unit_price])
+            return
+
+        remaining = quantity
+        while remaining > EPSILON and position.lots:
+            lot = position.lots[-1] if self.method == "lifo" else position.lots[0]
+            sold = min(remaining, lot[0])
+            position.realized += sold * (unit_price - lot[1])
+            position.shares -= sold
+            position.cost -= sold * lot[1]
+            lot[0] -= sold
+            remaining -= sold
+            if lot[0] <= EPSILON:
+                if self.method == "lifo":
+                    position.lots.pop()
+                else:
+                    position.lots.popleft()
+        if not position.lots:
+            position.shares = 0
+            position.cost = 0.0
+
+    def snapshot(self):
+        """Return {ticker: Position} for every ticker the ledger has seen."""
+        with self._lock:
+            return dict(self.positions)
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(method: str = "fifo", portfolio_id: str = portfolios.DEFAULT_PORTFOLIO) -> LotLedger:
+    """Return the process-wide ledger for a portfolio and cost basis method, loading its saved state on first use."""
+    key = (portfolio_id, method)
+    with _ledgers_lock:
+        if key not in _ledgers:
+            _ledgers[key] = LotLedger(method, ledger_path(method, portfolio_id))
+        return _ledgers[key]
+
+
+def drop_ledgers(portfolio_id: str):
+    """Forget and delete the saved ledgers of a removed portfolio."""
+    with _ledgers_lock:
+        for method in COST_BASIS_METHODS:
+            _ledgers.pop((portfolio_id, method), None)
+            try:
+                os.remove(ledger_path(method, portfolio_id))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,203 @@
+"""
+Optional intraday live prices (LIVE_PRICES=1).
+
+An asyncio poller downloads the last few daily bars of every held ticker each LIVE_POLL_SECONDS
+in one batched request; while the market is open the newest bar is the running session. Each
+ticker keeps its recent session closes in a fixed-size ring buffer, so /holdings reads the latest
+and previous close from memory instead of querying the database. Tickers that fail to quote back
+off exponentially, each on its own schedule. Streams subscribe to be told which tickers changed.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LIVE_PRICES = os.getenv("LIVE_PRICES", "0") == "1"
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "15"))
+LIVE_MAX_BACKOFF_SECONDS = float(os.getenv("LIVE_MAX_BACKOFF_SECONDS", "600"))
+# Session closes kept per ticker; two are enough for the day change
+LIVE_RING_SIZE = max(int(os.getenv("LIVE_RING_SIZE", "8")), 2)
+# Daily bars per poll: enough to find the previous close across a long weekend
+QUOTE_PERIOD = "5d"
+
+
+class CloseRing:
+    """Fixed-size ring of (session day, close). Quotes for the newest session overwrite it in place."""
+
+    __slots__ = ("days", "closes", "size", "_head")
+
+    def __init__(self, capacity: int = LIVE_RING_SIZE):
+        self.days = np.zeros(capacity, dtype="datetime64[D]")
+        self.closes = np.full(capacity, np.nan)
+        self.size = 0
+        self._head = -1
+
+    def push(self, day, close: float) -> bool:
+        """Record a session close; returns True when the ring changed. Older sessions are ignored."""
+        day = np.datetime64(day, "D")
+        if self.size and day < self.days[self._head]:
+            return False
+        if self.size and day == self.days[self._head]:
+            if self.closes[self._head] == close:
+                return False
+        else:
+            self._head = (self._head + 1) % len(self.closes)
+            self.size = min(self.size + 1, len(self.closes))
+            self.days[self._head] = day
+        self.closes[self._head] = close
+        return True
+
+    def latest(self, count: int = 2) -> np.ndarray:
+        """Up to `count` closes, newest first."""
+        slots = (self._head - np.arange(min(count, self.size))) % len(self.closes)
+        return self.closes[slots]
+
+
+class Subscription:
+    """Tickers changed since a stream last looked, coalesced so a slow client never queues up."""
+
+    def __init__(self):
+        self.pending = set()
+        self._event = asyncio.Event()
+
+    def notify(self, changed: set):
+        self.pending |= changed
+        self._event.set()
+
+    async def wait(self, timeout: float) -> set:
+        """Changed tickers, or an empty set if nothing changed within timeout seconds."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return set()
+        self._event.clear()
+        changed, self.pending = self.pending, set()
+        return changed
+
+
+def fetch_quotes(tickers: list) -> pd.DataFrame:
+    """Recent daily closes (session days x tickers) for all tickers in one download."""
+    with metrics.timer(metrics.LIVE_FETCH_SECONDS):
+        data = yf.download(
+            tickers, period=QUOTE_PERIOD, interval="1d", session=db.session,
+            group_by="column", progress=False, threads=False,
+        )
+    if data is None or data.empty:
+        return pd.DataFrame()
+    closes = data["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(tickers[0])
+    return closes
+
+
+class LiveFeed:
+    def __init__(self, interval: float = LIVE_POLL_SECONDS, capacity: int = LIVE_RING_SIZE,
+                 max_backoff: float = LIVE_MAX_BACKOFF_SECONDS, fetch=fetch_quotes):
+        self.interval = interval
+        self.capacity = capacity
+        self.max_backoff = max_backoff
+        self.fetch = fetch
+        self._rings = {}
+        self._failures = {}  # ticker -> consecutive polls without a quote
+        self._next_due = {}  # ticker -> time.monotonic() of its next poll
+        self._subscriptions = set()
+        # Rings are read by request handlers in worker threads while the poller updates them
+        self._lock = threading.Lock()
+
+    def latest_prices(self, tickers=None) -> dict:
+        """{ticker: {"close": , "prev_close": }} from the rings, like db.fetch_latest_prices."""
+        with self._lock:
+            rings = self._rings if tickers is None else {t: self._rings[t] for t in tickers if t in self._rings}
+            latest_prices = {}
+            for ticker, ring in rings.items():
+                closes = ring.latest(2)
+                latest_prices[ticker] = {"close": float(closes[0])}
+                if len(closes) > 1:
+                    latest_prices[ticker]["prev_close"] = float(closes[1])
+            return latest_prices
+
+    def due(self, tickers, now: float) -> list:
+        return [ticker for ticker in tickers if self._next_due.get(ticker, 0) <= now]
+
+    def apply(self, closes: pd.DataFrame, tickers, now: float) -> set:
+        """Push one poll's closes into the rings and reschedule each ticker. Returns the changed tickers."""
+        changed = set()
+        with self._lock:
+            for ticker in tickers:
+                series = closes[ticker].dropna() if ticker in closes else None
+                if series is None or series.empty:
+                    failures = self._failures.get(ticker, 0) + 1
+                    self._failures[ticker] = failures
+                    self._next_due[ticker] = now + min(self.interval * 2 ** failures, self.max_backoff)
+                    metrics.LIVE_QUOTE_FAILURES.inc()
+                    if failures == 1:
+                        logger.warning(f"⚠️ No live quote for {ticker}, backing off.")
+                    continue
+                self._failures.pop(ticker, None)
+                self._next_due[ticker] = now + self.interval
+                ring = self._rings.get(ticker)
+                if ring is None:
+                    ring = self._rings[ticker] = CloseRing(self.capacity)
+                index = pd.DatetimeIndex(series.index)
+                if index.tz is not None:
+                    index = index.tz_localize(None)
+                days = index.to_numpy().astype("datetime64[D]")
+                pushed = [ring.push(day, close) for day, close in zip(days, series.to_numpy(dtype=float))]
+                if any(pushed):
+                    changed.add(ticker)
+        return changed
+
+    async def poll(self, tickers) -> set:
+        """Fetch quotes for the tickers that are due and notify subscribers of changes."""
+        due = self.due(tickers, time.monotonic())
+        if not due:
+            return set()
+        try:
+            closes = await asyncio.to_thread(self.fetch, due)
+        except Exception as e:
+            metrics.YF_FETCH_ERRORS.inc()
+            logger.error(f"Error fetching live quotes for {len(due)} tickers: {e}")
+            closes = pd.DataFrame()
+        changed = self.apply(closes, due, time.monotonic())
+        if changed:
+            for subscription in list(self._subscriptions):
+                subscription.notify(changed)
+        return changed
+
+    async def run(self, tickers, on_change=None):
+        """
+        Poll until cancelled. tickers() is called before every poll for the current watch list;
+        on_change(changed) runs after polls that changed any price.
+        """
+        logger.info(f"📡 Live prices enabled, polling every {self.interval:g}s.")
+        while True:
+            try:
+                changed = await self.poll(tickers())
+                if changed and on_change is not None:
+                    on_change(changed)
+            except Exception as e:
+                logger.error(f"Live price poll failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        self._subscriptions.add(subscription)
+        metrics.LIVE_SUBSCRIBERS.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+        metrics.LIVE_SUBSCRIBERS.set(len(self._subscriptions))
+
+
+feed = LiveFeed()
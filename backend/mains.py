@@ -1,13 +1,28 @@
 import asyncio
-from collections import defaultdict
-from datetime import datetime, timedelta
-import functools
-from fastapi import FastAPI, BackgroundTasks
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import json
+import os
+import threading
+from typing import Annotated, Literal, Optional
+from fastapi import FastAPI, BackgroundTasks, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 import numpy as np
+import analytics
 import db
-import pandas as pd
+import downsample
+import ledger
+import live
+import metrics
+import portfolios
+import price_gaps
+import price_store
+import risk
+import scenarios
+import sectors
+import snapshots
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -16,300 +31,624 @@ logger = logging.getLogger(__name__)
 app = FastAPI()
 from fastapi.middleware.cors import CORSMiddleware
 
+# Default-parameter analytics responses are served from precomputed snapshots
+SNAPSHOT_PATHS = ("/portfolio_value", "/trades", "/portfolio_performance", "/sector_breakdown", "/holdings", "/sharpe_ratio", "/risk_metrics")
+app.add_middleware(snapshots.SnapshotMiddleware, store=snapshots.store, paths=SNAPSHOT_PATHS)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], 
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 # Create APScheduler for periodic tasks
 scheduler = BackgroundScheduler()
 
-holdings = pd.read_csv("holdings.csv")
-holdings["Date"] = pd.to_datetime(holdings["Date"]).dt.strftime("%Y-%m-%d")
+# Holdings of every portfolio, from PORTFOLIO_FILES (holdings.csv by default) and earlier uploads
+portfolios.registry.load()
+DEFAULT_PORTFOLIO = portfolios.DEFAULT_PORTFOLIO
 
+# Valuations of all portfolios against the current price matrix snapshot, per resolution
+_valuations = {}
 
+# Rolling risk frames keyed by (portfolio, resolution, window, risk-free rate), valid for one valuation.
+# window and risk_free_rate come from clients, so the cache is a bounded LRU
+RISK_CACHE_SIZE = int(os.getenv("RISK_CACHE_SIZE", "32"))
+_risk_cache = OrderedDict()
+_risk_cache_lock = threading.Lock()
 
-# Cache sector data to avoid repeated API calls
-sector_cache = {}
+# Time-series resolutions and how many periods make up a year at each
+PERIODS_PER_YEAR = {"daily": 252, "weekly": 52, "monthly": 12}
+
+# Only one ingestion runs at a time; the first finished run marks the backend as ready.
+# Tickers requested while the lock is held are queued and ingested as soon as it is released
+_ingestion_lock = threading.Lock()
+_queued_tickers = set()
+_queue_lock = threading.Lock()
+initial_ingestion_done = threading.Event()
+
+# Live mode: the background poller task, and how often an idle holdings stream sends a keepalive
+_live_task = None
+LIVE_KEEPALIVE_SECONDS = 15
 
 
 def float_to_percents(value):
     return f"{value*100:.2f}%" if not np.isnan(value) else "N/A"
 
-def monthly_portfolio_holding_values(stock_prices, holdings: pd.DataFrame):
-    grouped = holdings.groupby("Date")
-    portfolio_values = {}
-    for trade_date, trade_data in grouped:
-        
-        shares_dict = dict(zip(trade_data["Symbol"], trade_data["Shares"]))
-        # print(f"price_data for {trade_date}: {result}")
-        tickers = shares_dict.keys()
-        # Calculate portfolio value for that month
-        total_value = sum(shares_dict.get(ticker, 0) * stock_prices.get(trade_date, {}).get(ticker, 0) for ticker in tickers)
-        
-        # Store value for this month
-        portfolio_values[trade_date] = total_value
-    
+def current_batch(resolution: str = "monthly"):
+    """
+    Return the batched valuation of every portfolio. A new price matrix rebuilds it; changed
+    holdings only recompute the portfolios and months that changed.
+    """
+    prices = price_store.store.get(resolution)
+    batch = _valuations.get(resolution)
+    hit = batch is not None and batch.prices is prices and batch.version == portfolios.registry.version
+    metrics.record_cache("valuation", hit)
+    if not hit:
+        reusable = batch is not None and batch.prices is prices
+        version, holdings, changes = portfolios.registry.changes_since(batch.version if reusable else -1)
+        with metrics.timer(span="valuation"):
+            if reusable and changes is not None:
+                batch = batch.updated(holdings, changes, version)
+            else:
+                batch = analytics.ValuationBatch(holdings, prices, step_holdings=resolution != "monthly", version=version)
+            _valuations[resolution] = batch
+    return batch
+
+
+def current_valuation(resolution: str = "monthly", portfolio_id: str = DEFAULT_PORTFOLIO):
+    """Return the vectorized valuation of one portfolio's holdings."""
+    return current_batch(resolution).get(portfolio_id)
+
+
+def current_risk(
+    resolution: str = "monthly", window: Optional[int] = None, risk_free_rate: float = 0.0,
+    portfolio_id: str = DEFAULT_PORTFOLIO,
+):
+    """Return the rolling risk frame for the current valuation, computed once per parameter set."""
+    valuation = current_valuation(resolution, portfolio_id)
+    window = window or PERIODS_PER_YEAR[resolution]
+    key = (portfolio_id, resolution, window, risk_free_rate)
+    with _risk_cache_lock:
+        cached = _risk_cache.get(key)
+        hit = cached is not None and cached[0] is valuation
+        if hit:
+            _risk_cache.move_to_end(key)
+    metrics.record_cache("risk", hit)
+    if hit:
+        return cached[1]
+    with metrics.timer(span="risk"):
+        benchmark = analytics.align_prices(valuation.prices, valuation.dates, ["^GSPC"])[:, 0]
+        frame = risk.rolling_risk(
+            valuation.dates, valuation.portfolio_values, benchmark, window, PERIODS_PER_YEAR[resolution], risk_free_rate
+        )
+    with _risk_cache_lock:
+        # Frames of an older valuation of this portfolio can never be hit again
+        for stale in [k for k, (v, _) in _risk_cache.items() if k[:2] == key[:2] and v is not valuation]:
+            del _risk_cache[stale]
+        _risk_cache[key] = (valuation, frame)
+        while len(_risk_cache) > RISK_CACHE_SIZE:
+            _risk_cache.popitem(last=False)
+    return frame
+
+
+def ingest_and_refresh(tickers=None):
+    """
+    Ingest new stock data (for every portfolio's tickers by default), then atomically swap in a
+    fresh shared price matrix.
+    """
+    tickers = portfolios.registry.tickers() if tickers is None else tickers
+    with _queue_lock:
+        if not _ingestion_lock.acquire(blocking=False):
+            _queued_tickers.update(tickers)
+            logger.info(f"Stock data ingestion already running, queued {len(tickers)} tickers for a follow-up run.")
+            return
+    try:
+        with metrics.job_timer("ingest_and_refresh"):
+            db.update_stock_data(tickers)
+            db.ingestion_progress.update(phase="refreshing")
+            price_store.store.refresh()
+            db.ingestion_progress.update(phase="materializing")
+            materialize_snapshot()
+    except Exception as e:
+        logger.error(f"Stock data ingestion failed: {e}")
+    finally:
+        db.ingestion_progress.update(phase=None)
+        initial_ingestion_done.set()
+        release_ingestion_lock()
+
+
+def release_ingestion_lock():
+    """Release the ingestion lock, then ingest any tickers queued while it was held."""
+    with _queue_lock:
+        queued = sorted(_queued_tickers)
+        _queued_tickers.clear()
+        _ingestion_lock.release()
+    if queued:
+        ingest_and_refresh(queued)
+
+
+def materialize_snapshot():
+    """Precompute every snapshot endpoint's default payload and publish them together."""
+    builders = {route.path: route.endpoint for route in app.routes if getattr(route, "path", None) in SNAPSHOT_PATHS}
+    return snapshots.store.materialize(builders)
+
+
+def repair_price_gaps(tickers=None):
+    """Refetch sessions missing from the stored history; republish the analytics if any bars came back."""
+    tickers = sorted(set(portfolios.registry.tickers()) | {"^GSPC"}) if tickers is None else tickers
+    # Repairs write prices and swap the price matrix, so they never overlap an ingestion
+    if not _ingestion_lock.acquire(blocking=False):
+        logger.info("Stock data ingestion running, skipping gap repair.")
+        return
+    try:
+        with metrics.job_timer("repair_price_gaps"):
+            run = price_gaps.repair_gaps(tickers)
+            if run["bars_repaired"]:
+                price_store.store.refresh()
+                materialize_snapshot()
+    except Exception as e:
+        logger.error(f"Price gap repair failed: {e}")
+    finally:
+        db.ingestion_progress.update(phase=None)
+        release_ingestion_lock()
+
+
+def refresh_sectors(tickers=None):
+    """Fetch missing or expired sectors; republish the snapshot if anything changed."""
+    tickers = portfolios.registry.tickers() if tickers is None else tickers
+    with metrics.job_timer("refresh_sectors"):
+        if sectors.cache.populate(tickers) and initial_ingestion_done.is_set():
+            materialize_snapshot()
+
+
+def current_latest_prices(tickers):
+    """Latest and previous closes of the tickers, from the live rings, and the database for the rest."""
+    latest_prices = live.feed.latest_prices(tickers)
+    missing = [ticker for ticker in tickers if ticker not in latest_prices]
+    if missing:
+        latest_prices.update(db.fetch_latest_prices(missing))
+    return latest_prices
+
+
+def on_live_prices(changed):
+    """New live quotes make the materialized /holdings payload stale."""
+    snapshots.store.invalidate("/holdings")
+
+
+def holding_rows(lot_ledger, lastest_prices):
+    """Open positions of a synced ledger as /holdings rows, priced at the latest closes."""
+    current_holdings = {
+        ticker: {
+            "total_cost": position.cost,
+            "total_shares": position.shares,
+            "unit_cost": position.unit_cost,
+            "realized_pnl": position.realized,
+        }
+        for ticker, position in lot_ledger.snapshot().items()
+        if position.shares > 0
+    }
+    res = []
+    for ticker, holding in current_holdings.items():
+        close_price = lastest_prices.get(ticker, {}).get("close")
+        open_price = lastest_prices.get(ticker, {}).get("prev_close")
+        # Tickers without stored closes yet are listed unpriced rather than failing the whole table
+        market_value = holding["total_shares"] * close_price if close_price is not None else None
+        unrealized = market_value - holding["total_cost"] if market_value is not None else None
+        day_change = close_price - open_price if close_price is not None and open_price is not None else None
+        res.append({
+            "ticker": ticker,
+            "quantity": holding["total_shares"],
+            "market_value": market_value,
+            "open": open_price,
+            "close": close_price,
+            "day_change": round(day_change, 2) if day_change is not None else None,
+            "total_change": round(unrealized, 2) if unrealized is not None else None,
+            "unit_cost": round(holding["unit_cost"], 2),
+            "total_cost": round(holding["total_cost"], 2),
+            "day_change_prc": float_to_percents(day_change / open_price) if day_change is not None and open_price else "N/A",
+            "total_change_prc": float_to_percents(
+                unrealized / holding["total_cost"] if holding["total_cost"] > 0 else 0
+            ) if unrealized is not None else "N/A",
+            "realized_pnl": round(holding["realized_pnl"], 2),
+            "unrealized_pnl": round(unrealized, 2) if unrealized is not None else None,
+        })
+    return sorted(res, key=lambda x: x["ticker"])
 
-    # Convert dictionary to time-series format
-    portfolio_series = [{"date": date, "value": round(value, 2)} for date, value in sorted(portfolio_values.items())]
-    return portfolio_series
+
+def reload_portfolios():
+    """Pick up edited holdings files; derived state recomputes only the changed months."""
+    for portfolio_id, new_tickers in portfolios.registry.reload_changed().items():
+        apply_portfolio_change(portfolio_id, new_tickers)
+
+
+def apply_portfolio_change(portfolio_id: str, new_tickers):
+    """After an upload or reload, load prices and sectors for tickers no portfolio held before and republish."""
+    if new_tickers:
+        refresh_sectors(sorted(new_tickers))
+        ingest_and_refresh(sorted(new_tickers))
+    elif portfolio_id == DEFAULT_PORTFOLIO and initial_ingestion_done.is_set():
+        materialize_snapshot()
 
 
 @app.on_event("startup")
 async def startup_event():
     """Run stock data ingestion on startup and schedule repeated execution."""
+    global _live_task
     logger.info("🚀 Running stock data ingestion on startup...")
-    db.update_stock_data(holdings["Symbol"].unique().tolist())  # Fetch stock data on app start
-    for ticker in holdings['Symbol'].unique():
-        sector_cache[ticker] = db.get_stock_sector(ticker)
-    # Schedule job to run every minute for testing
+    loop = asyncio.get_running_loop()
+    # Ingestion and sector lookups run off the event loop; requests are served meanwhile
+    loop.run_in_executor(None, ingest_and_refresh)
+    loop.run_in_executor(None, refresh_sectors)
+    # Jobs read the tickers of all registered portfolios each time they run
+    scheduler.add_job(ingest_and_refresh, "cron", hour=16, minute=15, misfire_grace_time=10)
+    scheduler.add_job(refresh_sectors, "cron", hour=5, minute=0, misfire_grace_time=60)
+    scheduler.add_job(repair_price_gaps, "cron", hour=17, minute=0, misfire_grace_time=60)
     scheduler.add_job(
-        functools.partial(db.update_stock_data, holdings["Symbol"].unique().tolist()), 
-        "cron", hour=16, minute=15, misfire_grace_time=10
+        reload_portfolios, "interval", seconds=portfolios.HOLDINGS_POLL_SECONDS, max_instances=1, coalesce=True
     )
     
+    if live.LIVE_PRICES:
+        _live_task = asyncio.create_task(live.feed.run(portfolios.registry.open_tickers, on_change=on_live_prices))
+    
     # Ensure APScheduler starts in the main thread
     if not scheduler.running:
         scheduler.start()
         logger.info("📅 Scheduled stock update job: Runs at 4:15pm.")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    if _live_task is not None:
+        _live_task.cancel()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    scenarios.shutdown_pool()
+
 @app.get("/portfolio_value")
-async def get_portfolio_value():
-    """Returns portfolio total value over time, adjusting for monthly trades."""
-    # Iterate over each trade month to compute portfolio value
-    stock_prices = db.get_monthly_stock_prices()
-    portfolio_series = monthly_portfolio_holding_values(stock_prices, holdings)
-    # print("hold values:", portfolio_series)
-    return portfolio_series
+async def get_portfolio_value(
+    resolution: str = "monthly",
+    max_points: Annotated[Optional[int], Query(ge=3)] = None,
+    portfolio: str = DEFAULT_PORTFOLIO,
+):
+    """
+    Returns portfolio total value over time, adjusting for monthly trades.
+    resolution is daily, weekly or monthly; max_points downsamples the series with LTTB.
+    """
+    if resolution not in PERIODS_PER_YEAR:
+        return {"error": f"Unknown resolution {resolution}"}
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+    valuation = await asyncio.to_thread(current_valuation, resolution, portfolio)
+    return downsample.downsample_records(valuation.value_series(), max_points, "value")
 
 @app.get("/trades")
-async def get_trades():
-    """Determines monthly trades based on changes in holdings and stock prices."""
+async def get_trades(
+    ticker: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    trade_type: Annotated[Optional[Literal["BUY", "SELL", "buy", "sell"]], Query(alias="type")] = None,
+    limit: Annotated[Optional[int], Query(ge=1, le=5000)] = None,
+    cursor: Optional[str] = None,
+    output: Annotated[str, Query(alias="format")] = "json",
+    portfolio: str = DEFAULT_PORTFOLIO,
+):
+    """
+    Determines monthly trades based on changes in holdings and stock prices, newest first.
+
+    Optional filters: ticker (comma-separated), start/end dates (inclusive), type (BUY or SELL).
+    With limit, results are paged and include a next_cursor to pass back as cursor.
+    format=ndjson streams one JSON trade per line instead.
+    """
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
     try:
-        # Load holdings data
-        stock_prices = db.get_monthly_stock_prices()  # Monthly closing prices
-    
-        trades = []
-
-        # Iterate over consecutive months to compute trades
-        previous_month_holdings = {}
-
-        for index, row in holdings.iterrows():
-            trade_date = row["Date"]
-            ticker = row["Symbol"]
-            shares_held = row["Shares"]
-
-            # Get previous month's holdings
-            previous_shares = previous_month_holdings.get(ticker, 0)
-            trade_volume = shares_held - previous_shares  # Net change in shares
-
-            if trade_volume != 0:  # If there is a trade (buy/sell)
-                price = stock_prices.get(trade_date, {}).get(ticker, None)
-
-                if price is not None:
-                    trades.append({
-                        "Date": trade_date,
-                        "Ticker": ticker,
-                        "Quantity": abs(trade_volume),
-                        "TotalPrice": abs(trade_volume) * price,
-                        "UnitPrice": price,
-                        "Type": "BUY" if trade_volume > 0 else "SELL"
-                    })
-            
-
-            # Update previous month's holdings
-            previous_month_holdings[ticker] = shares_held
-        trades.sort(key=lambda x: x["Date"], reverse=True)
-        return {"trades": trades}
+        valuation = await asyncio.to_thread(current_valuation, "monthly", portfolio)
+        trades = analytics.filter_trades(
+            valuation.trades_newest_first,
+            tickers=ticker.split(",") if ticker else None,
+            start=start.isoformat() if start else None,
+            end=end.isoformat() if end else None,
+            trade_type=trade_type,
+        )
+        next_cursor = None
+        if limit is not None or cursor:
+            trades, next_cursor = analytics.page_trades(trades, limit or len(trades), cursor)
+    except ValueError as e:
+        return {"error": str(e)}
     except Exception as e:
         logger.error(f"Error computing trades: {e}")
         return {"error": "Failed to determine trades"}
 
+    if output == "ndjson":
+        def stream_rows():
+            for row in trades.itertuples(index=False):
+                yield json.dumps(row._asdict()) + "\n"
+        return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
+
+    response = {"trades": trades.to_dict("records")}
+    if limit is not None or cursor:
+        response["next_cursor"] = next_cursor
+    return response
+
 
 @app.get("/portfolio_performance")
-async def get_portfolio_performance():
+async def get_portfolio_performance(
+    resolution: str = "monthly",
+    max_points: Annotated[Optional[int], Query(ge=3)] = None,
+    portfolio: str = DEFAULT_PORTFOLIO,
+):
     """
     Returns the portfolio's performance over time compared to the S&P 500.
     Normalized to a base value of 100 at the start for percentage-based comparison.
     """
-    # Load holdings data (to compute portfolio value)
-    stock_prices = db.get_monthly_stock_prices()  # Historical stock prices
-    portfolio_values = monthly_portfolio_holding_values(stock_prices, holdings)
-    sp500_prices = db.get_monthly_SP_prices()
-    # Normalize portfolio and S&P 500 values to 100 at the start
-    # print("portfolio values: ", portfolio_values)
-    # print("sp500 prices: ", sp500_prices)
-    if not portfolio_values or not sp500_prices:
+    if resolution not in PERIODS_PER_YEAR:
+        return {"error": f"Unknown resolution {resolution}"}
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+    valuation = await asyncio.to_thread(current_valuation, resolution, portfolio)
+    performance_data = valuation.performance_series("^GSPC")
+    if not performance_data:
         return {"error": "Missing portfolio or S&P 500 data"}
+    return downsample.downsample_records(performance_data, max_points, "portfolio")
 
-    start_date = portfolio_values[0]['date']
-    base_portfolio_value = portfolio_values[0]['value']
-    base_sp500_value = sp500_prices[start_date]
+@app.get("/sector_breakdown")
+async def get_sector_breakdown(portfolio: str = DEFAULT_PORTFOLIO):
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+    # Tickers whose sector is still being fetched in the background count as Unknown
+    valuation = await asyncio.to_thread(current_valuation, "monthly", portfolio)
+    return valuation.sector_weights(sectors.cache.mapping())
 
-    # print(portfolio_values)
-    # print(sp500_prices)
-    performance_data = []
-    for point in portfolio_values:
-        if point['date'] in sp500_prices:
-            normalized_portfolio = (point['value'] / base_portfolio_value) * 100
-            normalized_sp500 = (sp500_prices[point['date']] / base_sp500_value) * 100
+@app.get("/holdings")
+async def get_current_holdings(method: str = "fifo", portfolio: str = DEFAULT_PORTFOLIO):
+    """Open positions with cost basis from the lot ledger (method: fifo, lifo or average)."""
+    if method not in ledger.COST_BASIS_METHODS:
+        return {"error": f"Unknown cost basis method {method}"}
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+
+    # The ledger sync and the latest-price query are independent, so run them concurrently
+    lot_ledger = ledger.get_ledger(method, portfolio)
+    tickers = portfolios.open_tickers(portfolios.registry.get(portfolio))
+    _, lastest_prices = await asyncio.gather(
+        asyncio.to_thread(lambda: lot_ledger.sync(current_valuation("monthly", portfolio).trades)),
+        asyncio.to_thread(current_latest_prices, tickers),
+    )
+    return holding_rows(lot_ledger, lastest_prices)
 
-            performance_data.append({
-                "date": point['date'],
-                "portfolio": normalized_portfolio,
-                "sp500": normalized_sp500
-            })
 
-    return performance_data
+@app.get("/holdings/stream")
+async def stream_holdings(request: Request, method: str = "fifo", portfolio: str = DEFAULT_PORTFOLIO):
+    """
+    Server-sent events with holdings rows as live prices change (LIVE_PRICES=1). The first
+    "holdings" event has every row, later ones only changed rows; "removed" lists closed positions.
+    Answers 204, which stops EventSource from reconnecting, when live mode is off.
+    """
+    if not live.LIVE_PRICES:
+        return Response(status_code=204)
+    if method not in ledger.COST_BASIS_METHODS:
+        return {"error": f"Unknown cost basis method {method}"}
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+
+    lot_ledger = ledger.get_ledger(method, portfolio)
+
+    def current_rows():
+        lot_ledger.sync(current_valuation("monthly", portfolio).trades)
+        tickers = portfolios.open_tickers(portfolios.registry.get(portfolio))
+        return holding_rows(lot_ledger, current_latest_prices(tickers))
+
+    async def events():
+        subscription = live.feed.subscribe()
+        sent = {}
+        try:
+            while True:
+                rows = {row["ticker"]: row for row in await asyncio.to_thread(current_rows)}
+                updates = [row for ticker, row in rows.items() if sent.get(ticker) != row]
+                removed = sorted(set(sent) - set(rows))
+                if updates:
+                    yield f"event: holdings\ndata: {json.dumps(updates)}\n\n"
+                if removed:
+                    yield f"event: removed\ndata: {json.dumps(removed)}\n\n"
+                sent = rows
+                while not await subscription.wait(LIVE_KEEPALIVE_SECONDS):
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+        finally:
+            live.feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-@app.get("/sector_breakdown")
-async def get_sector_breakdown():
-    # Load holdings data
-    stock_prices = db.get_monthly_stock_prices()
-
-    sector_breakdown = {}
-
-    # Compute sector-wise distribution over time
-    previous_holdings = {}
-    for date, trade_data in holdings.groupby("Date"):
-        shares_dict = dict(zip(trade_data["Symbol"], trade_data["Shares"]))
-        # print("shares_dict: ", shares_dict)
-        sector_values = {}
-        for index, row in trade_data.iterrows():
-            ticker = row["Symbol"]
-            shares = row["Shares"]
-            price = stock_prices.get(date, {}).get(ticker, None)
-            if price is None:
-                # print(f"Skipping missing price for {ticker}")
-                continue  # Skip if price is missing
-
-            if ticker not in sector_cache:
-                sector_cache[ticker] = db.get_stock_sector(ticker)
-        
-            sector = sector_cache[ticker]
-            if sector == "Unknown":
-                # print(f"Skipping unknown sector for {ticker}")
-                continue
-
-            sector_values[sector] = sector_values.get(sector, 0) + shares * price
-        # print("sector values: ", sector_values)
-        normalized_values = {sector: value / sum(sector_values.values()) for sector, value in sector_values.items()}
-        # print("normalized values: ", normalized_values)
-        sector_breakdown[date] = normalized_values
-
-    breakdown_series = [
-        {"date": date, "sectors": sector_breakdown[date]} for date in sorted(sector_breakdown.keys())
-    ]
-
-    return breakdown_series
+@app.get("/sharpe_ratio")
+async def get_sharpe_ratio(
+    resolution: str = "monthly",
+    max_points: Annotated[Optional[int], Query(ge=3)] = None,
+    window: Annotated[Optional[int], Query(ge=2)] = None,
+    portfolio: str = DEFAULT_PORTFOLIO,
+):
+    """
+    Computes the rolling Sharpe ratio over time from daily, weekly or monthly returns.
+    The window defaults to one year of periods at the chosen resolution.
+    """
+    if resolution not in PERIODS_PER_YEAR:
+        return {"error": f"Unknown resolution {resolution}"}
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+    # Rolling Sharpe Ratio (Assume risk-free rate = 0%)
+    frame = await asyncio.to_thread(current_risk, resolution, window, 0.0, portfolio)
+    sharpe_series = risk.to_records(frame, columns=["sharpe_ratio"])
+    return downsample.downsample_records(sharpe_series, max_points, "sharpe_ratio")
+
+
+@app.get("/risk_metrics")
+async def get_risk_metrics(
+    resolution: str = "monthly",
+    window: Annotated[Optional[int], Query(ge=2)] = None,
+    risk_free_rate: float = 0.0,
+    max_points: Annotated[Optional[int], Query(ge=3)] = None,
+    portfolio: str = DEFAULT_PORTFOLIO,
+):
+    """
+    Rolling Sharpe, Sortino, volatility, max drawdown, and beta/alpha/tracking error vs the S&P 500.
+    window defaults to one year of periods; risk_free_rate is annual.
+    """
+    if resolution not in PERIODS_PER_YEAR:
+        return {"error": f"Unknown resolution {resolution}"}
+    if portfolios.registry.get(portfolio) is None:
+        return {"error": f"Unknown portfolio {portfolio}"}
+    frame = await asyncio.to_thread(current_risk, resolution, window, risk_free_rate, portfolio)
+    return downsample.downsample_records(risk.to_records(frame), max_points, "sharpe_ratio")
 
-@app.get("/holdings")
-async def get_current_holdings():
-
-    trades = await get_trades()
-    trades = reversed(trades['trades'])
-    cost_basis = defaultdict(list)
-    current_holdings = {}
-    for trade in trades:
-        ticker = trade["Ticker"]
-        quantity = trade["Quantity"]
-        unit_price = trade["UnitPrice"]
-        trade_type = trade["Type"].strip().upper()
-        if trade_type == "BUY":
-            # Add purchase to FIFO queue
-            cost_basis[ticker].append((quantity, unit_price))
-
-        elif trade_type == "SELL":
-            # Handle selling using FIFO
-            shares_to_sell = quantity
-            while shares_to_sell > 0 and cost_basis[ticker]:
-                bought_shares, bought_price = cost_basis[ticker][-1]
-
-                if shares_to_sell >= bought_shares:
-                    # Selling all shares from this batch
-                    shares_to_sell -= bought_shares
-                    cost_basis[ticker].pop()
-                else:
-                    # Selling only part of this batch
-                    cost_basis[ticker][-1] = (bought_shares - shares_to_sell, bought_price)
-                    shares_to_sell = 0
-
-
-    # Compute total cost, total shares, and unit cost for each held stock
-    for ticker, queue in cost_basis.items():
-        total_shares = sum(shares for shares, _ in queue)
-        total_cost = sum(shares * price for shares, price in queue)
-        unit_cost = total_cost / total_shares if total_shares > 0 else 0
-        current_holdings[ticker] = {
-            "total_cost": round(total_cost, 2),
-            "total_shares": total_shares,
-            "unit_cost": round(unit_cost, 2)
-        }
-    lastest_prices =  db.fetch_latest_prices()
-    # print("latest prices: ", lastest_prices)
-    res = [
-        {
-            "ticker": ticker,
-            "quantity": holding["total_shares"],
-            "market_value": (market_value := 
-             holding["total_shares"] 
-             * lastest_prices.get(ticker, {}).get("close", "NULL")),
-            "open": (open_price:=lastest_prices.get(ticker, {}).get("prev_close", "NULL")),
-            "close": (close_price:=lastest_prices.get(ticker, {}).get("close", "NULL")),
-            "day_change": 
-                round(close_price - open_price, 2),
-            "total_change": round(market_value - holding["total_cost"], 2),
-            "unit_cost": round(holding["unit_cost"], 2),
-            "total_cost": round(holding["total_cost"], 2),
-            "day_change_prc": float_to_percents(
-                (
-                  lastest_prices.get(ticker, {}).get("close", "NULL") 
-                  - lastest_prices.get(ticker, {}).get("prev_close", "NULL")
-                )
-                / lastest_prices.get(ticker, {}).get("prev_close", "NULL"),
-            ),
-            "total_change_prc": float_to_percents(
-                (market_value - holding["total_cost"])
-                / holding["total_cost"] if holding["total_cost"] > 0 else 0
-            )
 
-        }
-        for ticker, holding in current_holdings.items()
-    ]
-    return sorted(res, key=lambda x: x["ticker"])
+@app.post("/scenarios")
+async def post_scenarios(request: Request):
+    """
+    Value a batch of what-if scenarios and return value, performance vs the S&P 500 and risk for each.
+
+    The JSON body has "scenarios" (a list) and optionally "resolution", "risk_free_rate" (annual),
+    "series" (include each value series) and "max_points". Each scenario is one of:
+      {"portfolio": id}: a registered portfolio's holdings
+      {"holdings": [{"Date", "Symbol", "Shares"}, ...]} or a holdings CSV string
+      {"weights": {ticker: weight} or "equal", "rebalance": none|monthly|quarterly|semiannual|annual,
+       "initial_value": 100000, "tickers": [...] (universe for "equal")}
+    with optional "name", "start", "end", "exclude_tickers" and "exclude_sectors".
+    """
+    try:
+        payload = await request.json()
+    except ValueError:
+        return {"error": "Request body must be JSON"}
+    if not isinstance(payload, dict):
+        return {"error": "Request body must be a JSON object"}
+    resolution = payload.get("resolution", "monthly")
+    if resolution not in PERIODS_PER_YEAR:
+        return {"error": f"Unknown resolution {resolution}"}
+    max_points = payload.get("max_points")
+    if max_points is not None and (not isinstance(max_points, int) or max_points < 3):
+        return {"error": "max_points must be an integer of at least 3"}
+    try:
+        risk_free_rate = float(payload.get("risk_free_rate", 0.0))
+        specs = await asyncio.to_thread(scenarios.parse_scenarios, payload, sectors.cache.mapping())
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+
+    context = {
+        "resolution": resolution,
+        "prices": await asyncio.to_thread(price_store.store.get, resolution),
+        "monthly": await asyncio.to_thread(price_store.store.get, "monthly"),
+        "periods_per_year": PERIODS_PER_YEAR[resolution],
+        "risk_free_rate": risk_free_rate,
+        "series": bool(payload.get("series")),
+        "max_points": max_points,
+    }
+    try:
+        with metrics.timer(metrics.SCENARIO_SECONDS, span="scenarios"):
+            results = await asyncio.to_thread(scenarios.run, specs, context)
+    except Exception as e:
+        logger.error(f"Error evaluating {len(specs)} scenarios: {e}")
+        return {"error": "Failed to evaluate scenarios"}
+    return {"resolution": resolution, "scenarios": results}
+
+
+@app.get("/portfolios")
+async def list_portfolios():
+    """Registered portfolios with their tickers, date range and latest monthly value."""
+    batch = await asyncio.to_thread(current_batch)
+    result = []
+    for portfolio_id, holdings in sorted(batch.holdings.items()):
+        dates, values = batch.values[portfolio_id]
+        result.append({
+            "portfolio": portfolio_id,
+            "tickers": int(holdings["Symbol"].nunique()),
+            "start": dates[0] if dates else None,
+            "end": dates[-1] if dates else None,
+            "value": round(float(values[-1]), 2) if len(values) else None,
+        })
+    return result
+
+
+@app.put("/portfolios/{portfolio_id}")
+async def put_portfolio(portfolio_id: str, request: Request, background_tasks: BackgroundTasks):
+    """
+    Register or replace a portfolio from a holdings CSV request body (Date, Symbol, Shares columns).
+    Prices and sectors for tickers no other portfolio holds are loaded in the background.
+    """
+    body = (await request.body()).decode("utf-8", errors="replace")
+    try:
+        holdings = await asyncio.to_thread(portfolios.parse_holdings_csv, body)
+        new_tickers = await asyncio.to_thread(portfolios.registry.register, portfolio_id, holdings, True)
+    except ValueError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        logger.error(f"Error registering portfolio {portfolio_id}: {e}")
+        return {"error": "Failed to read holdings"}
+    background_tasks.add_task(apply_portfolio_change, portfolio_id, new_tickers)
+    return {"portfolio": portfolio_id, "rows": len(holdings), "new_tickers": sorted(new_tickers)}
 
-@app.get("/sharpe_ratio")
-async def get_sharpe_ratio():
+
+@app.delete("/portfolios/{portfolio_id}")
+async def delete_portfolio(portfolio_id: str, background_tasks: BackgroundTasks):
+    try:
+        removed = portfolios.registry.remove(portfolio_id)
+    except ValueError as e:
+        return {"error": str(e)}
+    if not removed:
+        return {"error": f"Unknown portfolio {portfolio_id}"}
+    ledger.drop_ledgers(portfolio_id)
+    background_tasks.add_task(apply_portfolio_change, portfolio_id, set())
+    return {"deleted": portfolio_id}
+
+
+@app.get("/coverage")
+async def get_coverage(ticker: Optional[str] = None):
     """
-    Computes the Sharpe ratio over time using monthly returns.
+    Stored vs expected trading sessions per ticker, the gaps still open and the recent repair runs.
+    ticker filters the report (comma-separated).
     """
-    # Get historical stock prices
-    portfolio_values = await get_portfolio_value()  # Ensure this endpoint exists
-    df = pd.DataFrame(portfolio_values)
+    tickers = ticker.split(",") if ticker else sorted(set(portfolios.registry.tickers()) | {"^GSPC"})
+    bar_dates = await asyncio.to_thread(db.get_stock_bar_dates)
+    return await asyncio.to_thread(price_gaps.coverage_log.report, bar_dates, tickers)
 
-    # Convert date column to datetime and sort
-    df["date"] = pd.to_datetime(df["date"])
-    df = df.sort_values("date")
 
-    # Compute monthly returns
-    df["returns"] = df["value"].pct_change()
+@app.post("/coverage/repair")
+async def post_coverage_repair(background_tasks: BackgroundTasks):
+    """Start a gap repair run in the background; its result shows up in /coverage."""
+    background_tasks.add_task(repair_price_gaps)
+    return {"status": "scheduled"}
+
+
+@app.delete("/coverage/unavailable")
+async def delete_coverage_unavailable(ticker: Optional[str] = None):
+    """
+    Forget the sessions given up on as unavailable (of the comma-separated tickers, or all) so the
+    next repair run refetches them.
+    """
+    tickers = ticker.split(",") if ticker else None
+    cleared = await asyncio.to_thread(price_gaps.coverage_log.clear_unavailable, tickers)
+    return {"cleared": cleared}
 
-    # Compute rolling Sharpe Ratio (Assume risk-free rate = 0%)
-    rolling_window = 12  # 12 months (1-year rolling Sharpe)
-    df["sharpe_ratio"] = df["returns"].rolling(window=rolling_window).mean() / df["returns"].rolling(window=rolling_window).std()
 
-    # Convert to JSON format
-    sharpe_series = [{"date": row["date"].strftime("%Y-%m-%d"), "sharpe_ratio": row["sharpe_ratio"]} for _, row in df.iterrows() if not pd.isna(row["sharpe_ratio"])]
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text-format metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-    return sharpe_series
 
+@app.get("/ingestion_status")
+async def get_ingestion_status():
+    """Progress of the current or last stock data ingestion run."""
+    return db.ingestion_progress.as_dict()
 
 
 @app.get("/")
 def root():
+    # The frontend waits for "pass", i.e. until the first ingestion has populated the database
+    if not initial_ingestion_done.is_set():
+        return {"message": "Stock data ingestion in progress", "status": "loading", "ingestion": db.ingestion_progress.as_dict()}
     return {"message": "Stock price update API is running!", "status": "pass",}
 
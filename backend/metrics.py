@@ -0,0 +1,212 @@
+"""
+Minimal Prometheus-style metrics and per-request timing spans.
+
+Metrics are kept in process and rendered in the Prometheus text exposition format by /metrics.
+Spans recorded while handling a request (InfluxDB queries, valuation builds, ...) are collected in a
+context variable and can be returned to the client as a Server-Timing header.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import threading
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+# Send a Server-Timing header on every response, not just requests carrying X-Timing: 1
+TIMING_HEADER_ALWAYS = os.getenv("TIMING_HEADER", "0") == "1"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_lock = threading.Lock()
+request_spans = ContextVar("request_spans", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self):
+        with _lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        samples = []
+        with _lock:
+            for key, state in self._values.items():
+                labels = self._labels(key)
+                for bound, count in zip(self.buckets, state["counts"]):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": bound}, count))
+                samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, state["count"]))
+                samples.append((f"{self.name}_sum", labels, state["sum"]))
+                samples.append((f"{self.name}_count", labels, state["count"]))
+        return samples
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def add_span(name: str, seconds: float):
+    """Add time to a named span of the current request, if one is being traced."""
+    spans = request_spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timer(histogram: Histogram = None, span: str = None, **labels):
+    """Time a block into a histogram and/or the current request's spans."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+        if span:
+            add_span(span, elapsed)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def job_timer(job: str):
+    """Record duration, finish time and outcome of a scheduled or background job."""
+    started = time.perf_counter()
+    status = "success"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        JOB_LAST_DURATION.set(time.perf_counter() - started, job=job)
+        JOB_LAST_RUN.set(time.time(), job=job)
+        JOB_RUNS.inc(job=job, status=status)
+
+
+def server_timing(spans: dict, total: float) -> str:
+    """Format spans as a Server-Timing header value (durations in milliseconds)."""
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in spans.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Record per-route latency and, on request, return the span breakdown as Server-Timing."""
+
+    async def dispatch(self, request, call_next):
+        spans = {}
+        token = request_spans.set(spans)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            elapsed = time.perf_counter() - started
+            request_spans.reset(token)
+            # Label by route template (/portfolios/{portfolio_id}), not the raw path, so ids and
+            # scanners can't blow up the label cardinality
+            matched = request.scope.get("route")
+            route = getattr(matched, "path", None) or request.scope.get("snapshot_path") or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=status)
+        if TIMING_HEADER_ALWAYS or request.headers.get("x-timing") == "1":
+            response.headers["Server-Timing"] = server_timing(spans, elapsed)
+        return response
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+INFLUX_QUERY_SECONDS = Histogram("influxdb_query_duration_seconds", "InfluxDB query latency by query.", ("query",))
+STORAGE_READ_SECONDS = Histogram(
+    "storage_read_duration_seconds", "Time to load price history from the embedded store.", ("backend",)
+)
+YF_FETCH_SECONDS = Histogram("yfinance_fetch_duration_seconds", "Duration of yfinance chunk downloads.")
+YF_FETCH_ERRORS = Counter("yfinance_fetch_errors_total", "Failed yfinance chunk downloads.")
+LIVE_FETCH_SECONDS = Histogram("live_quote_fetch_duration_seconds", "Duration of live quote downloads.")
+LIVE_QUOTE_FAILURES = Counter("live_quote_failures_total", "Tickers missing from a live quote poll.")
+LIVE_SUBSCRIBERS = Gauge("live_stream_subscribers", "Open live holdings streams.")
+INGEST_ROWS = Counter("ingestion_rows_total", "Rows handled by store_stock_prices by outcome.", ("result",))
+INGEST_ERRORS = Counter("ingestion_errors_total", "Write errors in store_stock_prices.")
+INGEST_ROWS_PER_SEC = Gauge("ingestion_rows_per_second", "Throughput of the last store_stock_prices run.")
+PRICE_GAPS = Gauge("price_history_missing_sessions", "Missing daily bars found by the last gap check.")
+REPAIRED_BARS = Counter("price_history_repaired_bars_total", "Missing daily bars refetched and stored.")
+SCENARIO_SECONDS = Histogram("scenario_batch_duration_seconds", "Time to value and score a /scenarios batch.")
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and hit/miss.", ("cache", "result"))
+JOB_LAST_DURATION = Gauge("job_last_duration_seconds", "Duration of the last run of a job.", ("job",))
+JOB_LAST_RUN = Gauge("job_last_run_timestamp_seconds", "Unix time the last run of a job finished.", ("job",))
+JOB_RUNS = Counter("job_runs_total", "Job runs by outcome.", ("job", "status"))
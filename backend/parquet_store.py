@@ -0,0 +1,168 @@
+"""
+Embedded, append-only Parquet price store: a local alternative to InfluxDB.
+
+Rows live under a hive-style layout, one directory per year:
+
+    <root>/year=2024/part-<time_ns>-<seq>.parquet
+
+Every ingestion chunk is appended as new part files, written to a temp name and renamed so readers
+never see partial files. Reads memory-map the part files and convert them to one pandas frame,
+which is cached until the next write; a row written later replaces an earlier one for the same
+(date, ticker), like a rewritten point in InfluxDB. Partitions that collect too many parts are compacted into one file.
+"""
+import glob
+import itertools
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Parts per year partition before they are compacted into a single file
+COMPACT_PARTS = int(os.getenv("PARQUET_COMPACT_PARTS", "16"))
+# Same earliest date as the InfluxDB range() in db.get_stock_price_frame
+HISTORY_START = pd.Timestamp("2014-12-31")
+
+SCHEMA = pa.schema(
+    [
+        ("_time", pa.timestamp("ns")),
+        ("ticker", pa.string()),
+        ("close_price", pa.float64()),
+        ("open_price", pa.float64()),
+        ("volume", pa.int64()),
+    ]
+)
+
+
+def window_last(wide: pd.DataFrame, resolution: str) -> pd.DataFrame:
+    """
+    Last close per daily, weekly or monthly window, the way aggregateWindow(fn: last) returns it:
+    windows are labelled by their stop time and weekly windows are aligned to the Unix epoch.
+    """
+    # Hour(168) rather than "7D": origin only applies to fixed-length frequencies, and newer pandas
+    # treats days as calendar days
+    rules = {
+        "daily": lambda: wide.resample("D", label="right", closed="left"),
+        "weekly": lambda: wide.resample(pd.offsets.Hour(168), label="right", closed="left", origin="epoch"),
+        "monthly": lambda: wide.resample("MS", label="right", closed="left"),
+    }
+    return rules[resolution]().last().dropna(how="all").rename_axis(columns=None)
+
+
+class ParquetStorage:
+    """Price history in local Parquet files, with the same interface as db.InfluxStorage."""
+
+    name = "parquet"
+
+    def __init__(self, root: str):
+        self.root = root
+        # Reentrant so the cached rows and their pivot are built under one hold of the lock
+        self._lock = threading.RLock()
+        self._sequence = itertools.count()
+        self._long = None
+        self._wide = None
+
+    def _partition(self, year) -> str:
+        return os.path.join(self.root, f"year={year}")
+
+    def _parts(self, directory: str = None) -> list:
+        # time_ns file names sort in write order, which decides which duplicate wins
+        pattern = os.path.join(directory or self.root, "**", "part-*.parquet")
+        return sorted(glob.glob(pattern, recursive=True), key=os.path.basename)
+
+    def _write_part(self, directory: str, table: pa.Table):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{time.time_ns():020d}-{next(self._sequence):06d}.parquet")
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read(self, paths: list) -> pd.DataFrame:
+        """Read part files through memory maps and keep the last write per (date, ticker)."""
+        if not paths:
+            return SCHEMA.empty_table().to_pandas()
+        table = pa.concat_tables([pq.read_table(path, memory_map=True, schema=SCHEMA) for path in paths])
+        long = table.to_pandas()
+        return long.drop_duplicates(["_time", "ticker"], keep="last").sort_values("_time", kind="stable")
+
+    def _compact(self, directory: str):
+        parts = self._parts(directory)
+        if len(parts) <= COMPACT_PARTS:
+            return
+        long = self._read(parts)
+        self._write_part(directory, pa.Table.from_pandas(long, schema=SCHEMA, preserve_index=False))
+        for path in parts:
+            os.remove(path)
+        logger.info(f"Compacted {len(parts)} parts in {directory}.")
+
+    def write(self, chunk: pd.DataFrame):
+        """Append rows from db.stock_frame_to_long (indexed by _time) as new part files."""
+        long = chunk.reset_index()
+        times = pd.DatetimeIndex(long["_time"])
+        if times.tz is not None:
+            times = times.tz_convert("UTC").tz_localize(None)
+        long["_time"] = times
+        with self._lock:
+            for year, rows in long.groupby(long["_time"].dt.year):
+                directory = self._partition(year)
+                self._write_part(directory, pa.Table.from_pandas(rows, schema=SCHEMA, preserve_index=False))
+                self._compact(directory)
+            self._long = self._wide = None
+
+    def _rows(self) -> pd.DataFrame:
+        """All stored rows, deduplicated and sorted by time; cached until the next write."""
+        with self._lock:
+            if self._long is None:
+                with metrics.timer(metrics.STORAGE_READ_SECONDS, span="parquet", backend=self.name):
+                    self._long = self._read(self._parts())
+            return self._long
+
+    def _close_prices(self) -> pd.DataFrame:
+        with self._lock:
+            if self._wide is None:
+                self._wide = self._rows().pivot(index="_time", columns="ticker", values="close_price")
+            return self._wide
+
+    def latest_dates(self) -> dict:
+        long = self._rows()
+        tomorrow = pd.Timestamp.now("UTC").tz_localize(None).normalize() + pd.Timedelta(days=1)
+        last = long[long["_time"] < tomorrow].groupby("ticker")["_time"].max()
+        return last.dt.strftime("%Y-%m-%d").to_dict()
+
+    def latest_prices(self, tickers=None) -> dict:
+        long = self._rows()
+        if tickers is not None:
+            long = long[long["ticker"].isin(list(tickers))]
+        latest_prices = {}
+        for ticker, closes in long.groupby("ticker")["close_price"]:
+            latest_prices[ticker] = {"close": closes.iat[-1]}
+            if len(closes) > 1:
+                latest_prices[ticker]["prev_close"] = closes.iat[-2]
+        return latest_prices
+
+    def prices_for_date(self, target_date: str) -> dict:
+        long = self._rows()
+        first = long[long["_time"] >= pd.Timestamp(target_date)].groupby("ticker")["close_price"].first()
+        return first.to_dict()
+
+    def bar_dates(self) -> dict:
+        long = self._rows()
+        long = long[long["_time"] >= HISTORY_START]
+        return db.group_bar_dates(long["ticker"], long["_time"])
+
+    def price_frame(self, resolution: str) -> pd.DataFrame:
+        wide = self._close_prices()
+        wide = wide[wide.index >= HISTORY_START]
+        if wide.empty:
+            return pd.DataFrame(dtype=float)
+        frame = window_last(wide, resolution)
+        frame.index = frame.index.strftime("%Y-%m-%d").to_numpy()
+        return frame.astype(float).sort_index(axis=1)
@@ -0,0 +1,244 @@
+"""
+Registry of named portfolios (funds, sleeves, client accounts).
+
+Portfolios are loaded from the CSV files listed in PORTFOLIO_FILES and from portfolios uploaded
+through the API, which are persisted under DATA_DIR/portfolios so they survive restarts. Every
+portfolio is a long-format holdings frame (Date as datetime64, Symbol as categorical, Shares);
+prices and sectors are shared.
+
+Source files are polled for changes and reloaded in place. Each change records which holdings
+dates differ, so derived state (valuations, trades, lots) only recomputes those months.
+"""
+import glob
+import io
+import logging
+import os
+import re
+import threading
+
+import pandas as pd
+
+import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTFOLIO = os.getenv("DEFAULT_PORTFOLIO", "default")
+# Comma-separated id=path pairs; a bare path registers the file under its base name
+PORTFOLIO_FILES = os.getenv("PORTFOLIO_FILES", f"{DEFAULT_PORTFOLIO}=holdings.csv")
+HOLDINGS_COLUMNS = ["Date", "Symbol", "Shares"]
+PORTFOLIO_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# How often source files are checked for changes, and how many changes are remembered
+HOLDINGS_POLL_SECONDS = int(os.getenv("HOLDINGS_POLL_SECONDS", "2"))
+MAX_CHANGES = 256
+
+
+def prepare_holdings(holdings: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compact, date-sorted Date (datetime64), Symbol (categorical), Shares columns.
+    Raises ValueError when required columns are missing or dates don't parse.
+    """
+    missing = [column for column in HOLDINGS_COLUMNS if column not in holdings]
+    if missing:
+        raise ValueError(f"Holdings are missing columns: {', '.join(missing)}")
+    holdings = holdings[HOLDINGS_COLUMNS].dropna(subset=["Symbol"])
+    try:
+        dates = pd.to_datetime(holdings["Date"])
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid holdings dates: {e}") from e
+    symbols = holdings["Symbol"]
+    if not isinstance(symbols.dtype, pd.CategoricalDtype):
+        symbols = symbols.astype(str).astype("category")
+    holdings = pd.DataFrame({"Date": dates, "Symbol": symbols, "Shares": holdings["Shares"]})
+    return holdings.sort_values("Date", kind="stable").reset_index(drop=True)
+
+
+def read_holdings_file(path: str) -> pd.DataFrame:
+    """Read a holdings CSV file from the server's filesystem, see prepare_holdings."""
+    return prepare_holdings(pd.read_csv(path))
+
+
+def parse_holdings_csv(text: str) -> pd.DataFrame:
+    """
+    Parse holdings CSV text, see prepare_holdings. The text is never treated as a path or URL,
+    so it is safe for request bodies.
+    """
+    return prepare_holdings(pd.read_csv(io.StringIO(text)))
+
+
+def open_tickers(holdings: pd.DataFrame) -> list:
+    """Sorted tickers with shares held on the latest holdings date (the open positions)."""
+    if holdings.empty:
+        return []
+    latest = holdings[holdings["Date"] == holdings["Date"].iloc[-1]]
+    shares = latest.groupby("Symbol", observed=True)["Shares"].sum()
+    return sorted(str(ticker) for ticker in shares.index[shares.to_numpy() > 0])
+
+
+def date_digests(holdings: pd.DataFrame) -> pd.Series:
+    """One order-independent hash of the positions held on each holdings date."""
+    rows = pd.DataFrame({"Symbol": holdings["Symbol"], "Shares": holdings["Shares"].astype(float)})
+    hashes = pd.util.hash_pandas_object(rows, index=False)
+    return hashes.groupby(holdings["Date"].to_numpy()).sum()
+
+
+def changed_dates(old: pd.DataFrame, new: pd.DataFrame) -> pd.DatetimeIndex:
+    """Holdings dates that were added, removed or edited between two versions of a portfolio."""
+    before, after = date_digests(old), date_digests(new)
+    dates = before.index.union(after.index)
+    differs = before.reindex(dates, fill_value=0).to_numpy() != after.reindex(dates, fill_value=0).to_numpy()
+    differs |= dates.isin(before.index) != dates.isin(after.index)
+    return pd.DatetimeIndex(dates[differs])
+
+
+class PortfolioRegistry:
+    """
+    Thread-safe {portfolio_id: holdings} map. version increases on every change so callers can
+    tell when derived state (valuations, snapshots) is stale.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(db.DATA_DIR, "portfolios")
+        self._portfolios = {}
+        self._sources = {}  # portfolio_id -> [path, (mtime_ns, size)] for reloading
+        self.configured = {DEFAULT_PORTFOLIO}  # loaded from PORTFOLIO_FILES on every start, so not removable
+        self._changes = []  # (version, portfolio_id, changed dates or None for everything)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.version = 0
+
+    def _path(self, portfolio_id: str) -> str:
+        return os.path.join(self.directory, f"{portfolio_id}.csv")
+
+    def load(self, files: str = PORTFOLIO_FILES):
+        """Register the configured CSV files, then every previously uploaded portfolio."""
+        for entry in filter(None, (part.strip() for part in files.split(","))):
+            portfolio_id, _, path = entry.rpartition("=")
+            portfolio_id = portfolio_id or os.path.splitext(os.path.basename(path))[0]
+            self.configured.add(portfolio_id)
+            try:
+                self.register(portfolio_id, read_holdings_file(path), source=path)
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Failed to load portfolio {portfolio_id} from {path}: {e}")
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.csv"))):
+            portfolio_id = os.path.splitext(os.path.basename(path))[0]
+            try:
+                self.register(portfolio_id, read_holdings_file(path), source=path)
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Failed to load uploaded portfolio {portfolio_id}: {e}")
+        logger.info(f"Loaded {len(self._portfolios)} portfolios.")
+
+    def register(self, portfolio_id: str, holdings: pd.DataFrame, persist: bool = False, source: str = None) -> set:
+        """
+        Add or atomically replace a portfolio. With persist=True the holdings are saved under the
+        registry directory (uploads). source is the file to watch for changes. Returns the tickers
+        not held by any portfolio before.
+        """
+        if not PORTFOLIO_ID.match(portfolio_id):
+            raise ValueError(f"Invalid portfolio id {portfolio_id!r}")
+        holdings = prepare_holdings(holdings)
+        # Registrations are serialized so each recorded diff is against the version it replaces
+        with self._write_lock:
+            if persist:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f"{self._path(portfolio_id)}.tmp"
+                holdings.to_csv(tmp_path, index=False, date_format="%Y-%m-%d")
+                os.replace(tmp_path, self._path(portfolio_id))
+                source = self._path(portfolio_id)
+            previous = self._portfolios.get(portfolio_id)
+            changed = changed_dates(previous, holdings) if previous is not None else None
+            with self._lock:
+                known = self._tickers()
+                self._portfolios[portfolio_id] = holdings
+                if source:
+                    self._sources[portfolio_id] = [source, _file_state(source)]
+                self._record_change(portfolio_id, changed)
+            return set(holdings["Symbol"].unique()) - known
+
+    def _record_change(self, portfolio_id: str, changed):
+        self.version += 1
+        self._changes.append((self.version, portfolio_id, changed))
+        del self._changes[:-MAX_CHANGES]
+
+    def changes_since(self, version: int):
+        """
+        (version, {portfolio_id: holdings}, {portfolio_id: changed dates}) for everything registered
+        after `version`. Changed dates are None where a portfolio is new, removed or must be rebuilt;
+        the whole change map is None when the changes are no longer remembered.
+        """
+        with self._lock:
+            portfolios = dict(self._portfolios)
+            if version == self.version:
+                return self.version, portfolios, {}
+            if not self._changes or self._changes[0][0] > version + 1:
+                return self.version, portfolios, None
+            changes = {}
+            for change_version, portfolio_id, changed in self._changes:
+                if change_version <= version:
+                    continue
+                if changed is None or changes.get(portfolio_id, ()) is None:
+                    changes[portfolio_id] = None
+                else:
+                    changes[portfolio_id] = changed.union(changes.get(portfolio_id, pd.DatetimeIndex([])))
+            return self.version, portfolios, changes
+
+    def reload_changed(self) -> dict:
+        """Reload every source file whose modification time or size changed. Returns {portfolio_id: new tickers}."""
+        reloaded = {}
+        for portfolio_id, (path, state) in list(self._sources.items()):
+            current = _file_state(path)
+            if current is None or current == state:
+                continue
+            try:
+                reloaded[portfolio_id] = self.register(portfolio_id, read_holdings_file(path), source=path)
+                logger.info(f"🔄 Reloaded portfolio {portfolio_id} from {path}.")
+            except (OSError, ValueError) as e:
+                # Keep serving the last good version; a half-written file is retried on the next change
+                self._sources[portfolio_id][1] = current
+                logger.error(f"❌ Failed to reload portfolio {portfolio_id} from {path}: {e}")
+        return reloaded
+
+    def remove(self, portfolio_id: str) -> bool:
+        """
+        Remove an uploaded portfolio and its saved file. Returns False for unknown ids; raises
+        ValueError for the default and configured portfolios, which every restart would bring back.
+        """
+        if portfolio_id in self.configured:
+            raise ValueError(f"Portfolio {portfolio_id} is configured in PORTFOLIO_FILES and can't be deleted")
+        with self._write_lock, self._lock:
+            if self._portfolios.pop(portfolio_id, None) is None:
+                return False
+            self._sources.pop(portfolio_id, None)
+            self._record_change(portfolio_id, None)
+        try:
+            os.remove(self._path(portfolio_id))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def get(self, portfolio_id: str):
+        return self._portfolios.get(portfolio_id)
+
+    def _tickers(self) -> set:
+        return {ticker for holdings in self._portfolios.values() for ticker in holdings["Symbol"].unique()}
+
+    def tickers(self) -> list:
+        """Sorted union of tickers over all portfolios."""
+        with self._lock:
+            return sorted(self._tickers())
+
+    def open_tickers(self) -> list:
+        """Sorted union of the tickers currently held by any portfolio."""
+        with self._lock:
+            holdings = list(self._portfolios.values())
+        return sorted({ticker for frame in holdings for ticker in open_tickers(frame)})
+
+
+def _file_state(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+registry = PortfolioRegistry()
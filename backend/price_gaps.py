@@ -0,0 +1,357 @@
+"""
+Gap detection and targeted backfill of stored price history.
+
+Each ticker's stored daily bars are compared with the NYSE trading calendar between its first and
+last stored bar; bars after the last one are the regular ingestion's job, which resumes from each
+ticker's watermark. Missing sessions are merged into ranges of consecutive sessions,
+tickers missing the same range share one download, and only those ranges are refetched, at most
+REPAIR_REQUESTS_PER_MINUTE requests per minute. Sessions that still come back empty (halts,
+special closures, delistings) are remembered as unavailable so they aren't refetched every run,
+but only when other tickers in the same response have bars for them or after REPAIR_MAX_ATTEMPTS
+empty refetches; an empty response for the whole request is a failed request (throttling), not
+missing data. Unavailable sessions expire after UNAVAILABLE_TTL_DAYS. Recent repair runs are kept
+in DATA_DIR/coverage.json for the /coverage report.
+"""
+from datetime import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay, USMartinLutherKingJr, USMemorialDay,
+    USPresidentsDay, USThanksgivingDay, nearest_workday, sunday_to_monday,
+)
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REPAIR_REQUESTS_PER_MINUTE = float(os.getenv("REPAIR_REQUESTS_PER_MINUTE", "30"))
+# Empty refetches of a session, on separate runs, before it is given up on without other evidence
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", "3"))
+# Sessions given up on are retried again after this many days
+UNAVAILABLE_TTL_DAYS = float(os.getenv("UNAVAILABLE_TTL_DAYS", "30"))
+# Repair runs kept for the coverage report
+MAX_RUNS = 20
+# Gap ranges listed per ticker in the coverage report
+MAX_REPORTED_GAPS = 50
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Regular NYSE full-day holidays. One-off closures end up as unavailable sessions instead."""
+
+    rules = [
+        # NYSE doesn't close on the Friday before when New Year's Day is a Saturday
+        Holiday("New Year's Day", month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday("Juneteenth", month=6, day=19, start_date="2022-01-01", observance=nearest_workday),
+        Holiday("Independence Day", month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday("Christmas Day", month=12, day=25, observance=nearest_workday),
+    ]
+
+
+def trading_sessions(start, end) -> np.ndarray:
+    """NYSE sessions between start and end (inclusive) as a sorted datetime64[D] array."""
+    sessions = pd.bdate_range(start, end, freq="C", holidays=NYSEHolidayCalendar().holidays(start, end))
+    return sessions.to_numpy().astype("datetime64[D]")
+
+
+def merge_ranges(missing: np.ndarray, sessions: np.ndarray) -> list:
+    """Merge sorted missing sessions into [(first, last)] ranges of consecutive sessions."""
+    positions = np.searchsorted(sessions, missing)
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks - 1, [len(missing) - 1]])
+    return [(missing[start], missing[end]) for start, end in zip(starts, ends)]
+
+
+def find_gaps(bar_dates: dict, tickers, unavailable: dict = None, today=None) -> dict:
+    """
+    Missing sessions of each ticker between its first and last bar (up to the last completed
+    session), skipping sessions known to be unavailable.
+
+    Returns:
+        dict: {ticker: (missing datetime64[D] array, [(first, last)] ranges)}
+    """
+    unavailable = unavailable or {}
+    last_session = np.datetime64(today or datetime.utcnow().date(), "D") - 1
+    stored = {ticker: bar_dates[ticker] for ticker in tickers if len(bar_dates.get(ticker, ()))}
+    if not stored:
+        return {}
+    sessions = trading_sessions(str(min(dates[0] for dates in stored.values())), str(last_session))
+    gaps = {}
+    for ticker, dates in stored.items():
+        expected = sessions[np.searchsorted(sessions, dates[0]):np.searchsorted(sessions, dates[-1], side="right")]
+        missing = np.setdiff1d(expected, dates, assume_unique=True)
+        if ticker in unavailable:
+            missing = np.setdiff1d(missing, np.array(unavailable[ticker], dtype="datetime64[D]"))
+        if missing.size:
+            gaps[ticker] = (missing, merge_ranges(missing, sessions))
+    return gaps
+
+
+def plan_repairs(gaps: dict, chunk_size: int = db.FETCH_CHUNK_SIZE) -> list:
+    """Group tickers missing the same range into downloads: [(first, last, [tickers])] by date."""
+    by_range = {}
+    for ticker, (_, ranges) in sorted(gaps.items()):
+        for first, last in ranges:
+            by_range.setdefault((first, last), []).append(ticker)
+    plan = []
+    for (first, last), tickers in sorted(by_range.items()):
+        for start in range(0, len(tickers), chunk_size):
+            plan.append((first, last, tickers[start:start + chunk_size]))
+    return plan
+
+
+class RateLimiter:
+    """Spaces calls at least 60 / per_minute seconds apart."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if delay:
+            time.sleep(delay)
+
+
+def _day(value) -> str:
+    return str(np.datetime64(value, "D"))
+
+
+class CoverageLog:
+    """
+    Unavailable sessions per ticker, empty refetch attempts of sessions not yet given up on and the
+    most recent repair runs, persisted as JSON.
+    """
+
+    def __init__(self, path: str = None, ttl_days: float = UNAVAILABLE_TTL_DAYS):
+        self.path = path or os.path.join(db.DATA_DIR, "coverage.json")
+        self.ttl_days = ttl_days
+        self.unavailable = {}  # {ticker: {"YYYY-MM-DD": marked_at}}
+        self.attempts = {}  # {ticker: {"YYYY-MM-DD": empty refetches}}
+        self.runs = []
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.unavailable, self.runs = state["unavailable"], state["runs"]
+            self.attempts = state.get("attempts", {})
+            # Older logs kept a plain list of days; their TTL starts now
+            self.unavailable = {
+                ticker: days if isinstance(days, dict) else dict.fromkeys(days, time.time())
+                for ticker, days in self.unavailable.items()
+            }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable coverage log {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            state = {"unavailable": self.unavailable, "attempts": self.attempts, "runs": self.runs}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+
+    def unavailable_sessions(self, now: float = None) -> dict:
+        """{ticker: [day, ...]} of sessions given up on within the last ttl_days."""
+        cutoff = (now or time.time()) - self.ttl_days * 86400
+        with self._lock:
+            sessions = {
+                ticker: sorted(day for day, marked_at in days.items() if marked_at >= cutoff)
+                for ticker, days in self.unavailable.items()
+            }
+        return {ticker: days for ticker, days in sessions.items() if days}
+
+    def record_attempts(self, ticker: str, days, max_attempts: int = REPAIR_MAX_ATTEMPTS) -> list:
+        """Count one more empty refetch of each day; returns the days that reached max_attempts."""
+        with self._lock:
+            attempts = self.attempts.setdefault(ticker, {})
+            exhausted = []
+            for day in days:
+                attempts[day] = attempts.get(day, 0) + 1
+                if attempts[day] >= max_attempts:
+                    exhausted.append(day)
+                    del attempts[day]
+            if not attempts:
+                del self.attempts[ticker]
+            return exhausted
+
+    def clear_attempts(self, ticker: str, days):
+        with self._lock:
+            attempts = self.attempts.get(ticker, {})
+            for day in days:
+                attempts.pop(day, None)
+            if ticker in self.attempts and not attempts:
+                del self.attempts[ticker]
+
+    def clear_unavailable(self, tickers=None) -> int:
+        """Forget unavailable sessions (of the given tickers, or all) so they are refetched. Returns how many."""
+        with self._lock:
+            tickers = list(self.unavailable) if tickers is None else [t for t in tickers if t in self.unavailable]
+            cleared = sum(len(self.unavailable.pop(ticker)) for ticker in tickers)
+            for ticker in tickers:
+                self.attempts.pop(ticker, None)
+        self.save()
+        return cleared
+
+    def add_run(self, run: dict, unavailable: dict, now: float = None):
+        marked_at = now or time.time()
+        with self._lock:
+            cutoff = marked_at - self.ttl_days * 86400
+            for ticker, days in unavailable.items():
+                self.unavailable.setdefault(ticker, {}).update(dict.fromkeys(days, marked_at))
+            # Expired entries are dropped for good so the file doesn't grow without bound
+            for ticker in list(self.unavailable):
+                days = {day: at for day, at in self.unavailable[ticker].items() if at >= cutoff}
+                if days:
+                    self.unavailable[ticker] = days
+                else:
+                    del self.unavailable[ticker]
+            self.runs = (self.runs + [run])[-MAX_RUNS:]
+        self.save()
+
+    def report(self, bar_dates: dict, tickers, today=None) -> dict:
+        """Stored vs expected sessions per ticker, current gaps, and the recent repair runs."""
+        unavailable = self.unavailable_sessions()
+        with self._lock:
+            runs = list(self.runs)
+        gaps = find_gaps(bar_dates, tickers, unavailable, today)
+        last_session = _day(np.datetime64(today or datetime.utcnow().date(), "D") - 1)
+        firsts = [bar_dates[ticker][0] for ticker in tickers if len(bar_dates.get(ticker, ()))]
+        sessions = trading_sessions(_day(min(firsts)), last_session) if firsts else np.array([], dtype="datetime64[D]")
+        rows = []
+        for ticker in sorted(tickers):
+            dates = bar_dates.get(ticker, np.array([], dtype="datetime64[D]"))
+            if not len(dates):
+                rows.append({"ticker": ticker, "first": None, "last": None, "stored": 0, "missing": None, "gaps": []})
+                continue
+            missing, ranges = gaps.get(ticker, (np.array([], dtype="datetime64[D]"), []))
+            expected = int(np.searchsorted(sessions, dates[-1], side="right") - np.searchsorted(sessions, dates[0]))
+            rows.append({
+                "ticker": ticker,
+                "first": _day(dates[0]),
+                "last": _day(dates[-1]),
+                "stored": int(len(dates)),
+                "expected": expected,
+                "missing": int(missing.size),
+                "unavailable": len(unavailable.get(ticker, [])),
+                "coverage": round(1 - missing.size / expected, 4) if expected else 1.0,
+                "gaps": [[_day(first), _day(last)] for first, last in ranges[:MAX_REPORTED_GAPS]],
+            })
+        return {
+            "missing_sessions": int(sum(missing.size for missing, _ in gaps.values())),
+            "tickers": rows,
+            "repairs": runs[::-1],
+        }
+
+
+def repair_gaps(tickers, log: CoverageLog = None, per_minute: float = REPAIR_REQUESTS_PER_MINUTE, today=None) -> dict:
+    """
+    Find missing sessions for the tickers, refetch only those ranges under the rate limit and store
+    what comes back. Returns the run record that is also added to the coverage log.
+    """
+    log = log or coverage_log
+    started_at = datetime.utcnow().isoformat()
+    gaps = find_gaps(db.get_stock_bar_dates(), tickers, log.unavailable_sessions(), today)
+    missing_total = int(sum(missing.size for missing, _ in gaps.values()))
+    metrics.PRICE_GAPS.set(missing_total)
+    plan = plan_repairs(gaps)
+    run = {
+        "started_at": started_at,
+        "finished_at": None,
+        "missing_sessions": missing_total,
+        "requests": len(plan),
+        "failed_requests": 0,
+        "empty_requests": 0,
+        "bars_repaired": 0,
+        "repaired": {},
+        "unavailable": {},
+    }
+    if plan:
+        logger.info(f"🩹 Repairing {missing_total} missing sessions of {len(gaps)} tickers in {len(plan)} requests...")
+
+    limiter = RateLimiter(per_minute)
+    frames = []
+    newly_unavailable = {}
+    for first, last, chunk in plan:
+        limiter.wait()
+        try:
+            data = db._download_chunk(_day(first), chunk, _day(last + 1))
+        except Exception as e:
+            # Failed requests are retried on the next run rather than marked unavailable
+            run["failed_requests"] += 1
+            metrics.YF_FETCH_ERRORS.inc()
+            logger.error(f"Error refetching {len(chunk)} tickers for {_day(first)}..{_day(last)}: {e}")
+            continue
+        closes = pd.DataFrame()
+        if data is not None:
+            data = data.loc[pd.Timestamp(first):pd.Timestamp(last)]
+            closes = data["Close"].dropna(how="all")
+        if closes.empty:
+            # yfinance returns nothing rather than raising when throttled or offline, so an empty
+            # response is only evidence after REPAIR_MAX_ATTEMPTS runs
+            run["empty_requests"] += 1
+        else:
+            frames.append(data)
+        # Sessions some ticker in the response has a bar for; others missing them there are really absent
+        answered = closes.index.to_numpy().astype("datetime64[D]")
+        for ticker in chunk:
+            missing = gaps[ticker][0]
+            missing = missing[(missing >= first) & (missing <= last)]
+            got = closes[ticker].dropna().index if ticker in closes else pd.DatetimeIndex([])
+            got = got.to_numpy().astype("datetime64[D]")
+            filled = np.intersect1d(missing, got)
+            if filled.size:
+                run["repaired"].setdefault(ticker, []).append([_day(first), _day(last), int(filled.size)])
+                run["bars_repaired"] += int(filled.size)
+                log.clear_attempts(ticker, [_day(day) for day in filled])
+            empty = np.setdiff1d(missing, got)
+            confirmed = np.intersect1d(empty, answered)
+            unanswered = [_day(day) for day in np.setdiff1d(empty, answered)]
+            given_up = [_day(day) for day in confirmed] + log.record_attempts(ticker, unanswered)
+            if given_up:
+                newly_unavailable.setdefault(ticker, []).extend(given_up)
+
+    if frames:
+        data = functools.reduce(pd.DataFrame.combine_first, frames)
+        stats = db.store_stock_prices(data)
+        run["store"] = stats
+        if stats and stats["rejected"]:
+            # Rows that failed to store aren't repaired; they'll be found again next run
+            logger.warning(f"{stats['rejected']} repaired rows were rejected by the storage.")
+    metrics.REPAIRED_BARS.inc(run["bars_repaired"])
+    run["unavailable"] = {ticker: len(days) for ticker, days in newly_unavailable.items()}
+    run["finished_at"] = datetime.utcnow().isoformat()
+    log.add_run(run, newly_unavailable)
+    if plan:
+        logger.info(
+            f"✅ Repaired {run['bars_repaired']} bars; {sum(run['unavailable'].values())} sessions unavailable, "
+            f"{run['failed_requests']} requests failed, {run['empty_requests']} came back empty."
+        )
+    return run
+
+
+coverage_log = CoverageLog()
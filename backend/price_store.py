@@ -0,0 +1,79 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PriceMatrix:
+    """
+    Immutable dates x tickers matrix of closing prices at one resolution.
+
+    Missing prices are NaN. Dates are "YYYY-MM-DD" strings so they line up with the holdings file.
+    """
+
+    def __init__(self, dates, tickers, values: np.ndarray):
+        self.dates = list(dates)
+        self.tickers = list(tickers)
+        self.values = values
+        self.values.flags.writeable = False
+        self.date_index = {date: i for i, date in enumerate(self.dates)}
+        self.ticker_index = {ticker: j for j, ticker in enumerate(self.tickers)}
+
+    def __reduce__(self):
+        # Pickle (e.g. for worker processes) only the arrays; the lookups are rebuilt
+        return PriceMatrix, (self.dates, self.tickers, self.values)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame):
+        """Build a matrix from a dates x tickers DataFrame such as db.get_stock_price_frame returns."""
+        frame = frame.sort_index()
+        frame = frame.reindex(columns=sorted(frame.columns))
+        return cls(frame.index, frame.columns, frame.to_numpy(dtype=float, copy=True))
+
+
+class PriceStore:
+    """
+    Process-wide holder of the current PriceMatrix for each resolution (daily, weekly, monthly).
+
+    Readers grab the current snapshot reference; refresh() builds new matrices off to the side and
+    swaps the references in one assignment, so requests never observe a half-built matrix.
+    Resolutions other than monthly are loaded on first use.
+    """
+
+    def __init__(self, loader=db.get_stock_price_frame):
+        self._loader = loader
+        self._matrices = {}
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, resolution: str = None, if_empty: bool = False) -> PriceMatrix:
+        """Rebuild one resolution, or (with no resolution) monthly plus every resolution already loaded."""
+        with self._refresh_lock:
+            if if_empty and resolution in self._matrices:
+                return self._matrices[resolution]
+            resolutions = [resolution] if resolution else sorted(set(self._matrices) | {"monthly"})
+            matrices = dict(self._matrices)
+            for res in resolutions:
+                with metrics.timer(span="price_store"):
+                    matrices[res] = PriceMatrix.from_frame(self._loader(res))
+                logger.info(
+                    f"Price store refreshed ({res}): {len(matrices[res].dates)} dates x "
+                    f"{len(matrices[res].tickers)} tickers."
+                )
+            self._matrices = matrices
+        return matrices[resolution or "monthly"]
+
+    def get(self, resolution: str = "monthly") -> PriceMatrix:
+        matrix = self._matrices.get(resolution)
+        metrics.record_cache("price_matrix", matrix is not None)
+        if matrix is None:
+            matrix = self.refresh(resolution, if_empty=True)
+        return matrix
+
+
+store = PriceStore()
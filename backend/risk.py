@@ -0,0 +1,133 @@
+"""
+Rolling risk metrics computed in one vectorized pass over a portfolio and its benchmark.
+
+Sharpe and Sortino are per-period ratios (not annualized), matching the original /sharpe_ratio
+endpoint. Volatility, alpha and tracking error are annualized with the resolution's periods per year.
+period_risk computes the same metrics over whole series, for many series at once.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+RISK_COLUMNS = ["sharpe_ratio", "sortino_ratio", "volatility", "max_drawdown", "beta", "alpha", "tracking_error"]
+
+
+def period_returns(values) -> np.ndarray:
+    """Simple returns with a leading NaN so they line up with the input dates."""
+    values = np.asarray(values, dtype=float)
+    returns = np.full(len(values), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns[1:] = values[1:] / values[:-1] - 1
+    return returns
+
+
+def rolling_max_drawdown(values, window: int) -> np.ndarray:
+    """Worst peak-to-trough decline inside each trailing window of `window` values."""
+    values = np.asarray(values, dtype=float)
+    drawdowns = np.full(len(values), np.nan)
+    if len(values) < window:
+        return drawdowns
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    peaks = np.maximum.accumulate(windows, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdowns[window - 1:] = (windows / peaks - 1).min(axis=1)
+    return drawdowns
+
+
+def rolling_risk(dates, values, benchmark, window: int, periods_per_year: int, risk_free_rate: float = 0.0) -> pd.DataFrame:
+    """
+    Rolling Sharpe, Sortino, volatility, max drawdown, beta, alpha and tracking error.
+
+    Args:
+        dates: "YYYY-MM-DD" dates of the series.
+        values: Portfolio values per date.
+        benchmark: Benchmark prices per date (NaN where missing).
+        window: Number of periods per rolling window.
+        periods_per_year: 252 (daily), 52 (weekly) or 12 (monthly), used for annualizing.
+        risk_free_rate: Annual risk-free rate, converted to a per-period rate.
+
+    Returns:
+        DataFrame indexed by date with RISK_COLUMNS; rows before a full window are NaN.
+    """
+    index = pd.Index(dates, name="date")
+    portfolio = pd.Series(period_returns(values), index=index)
+    market = pd.Series(period_returns(benchmark), index=index)
+    rf = (1 + risk_free_rate) ** (1 / periods_per_year) - 1
+    excess = portfolio - rf
+    market_excess = market - rf
+    annualizer = np.sqrt(periods_per_year)
+
+    mean_excess = excess.rolling(window).mean()
+    beta = portfolio.rolling(window).cov(market) / market.rolling(window).var()
+    downside = np.sqrt((excess.clip(upper=0) ** 2).rolling(window).mean())
+
+    return pd.DataFrame(
+        {
+            "sharpe_ratio": mean_excess / excess.rolling(window).std(),
+            "sortino_ratio": mean_excess / downside,
+            "volatility": portfolio.rolling(window).std() * annualizer,
+            "max_drawdown": rolling_max_drawdown(values, window),
+            "beta": beta,
+            "alpha": (mean_excess - beta * market_excess.rolling(window).mean()) * periods_per_year,
+            "tracking_error": (portfolio - market).rolling(window).std() * annualizer,
+        },
+        index=index,
+    ).replace([np.inf, -np.inf], np.nan)
+
+
+def period_risk(values, benchmark, periods_per_year: int, risk_free_rate: float = 0.0) -> dict:
+    """
+    RISK_COLUMNS over each series' whole history, for many series side by side.
+
+    Args:
+        values: (periods x series) portfolio values, NaN where a series has no value (e.g. before it starts).
+        benchmark: (periods x series) benchmark prices on the same grid, NaN where missing.
+
+    Returns:
+        dict: {column: array with one value per series}. The definitions match rolling_risk with a
+        single window spanning the series; periods without a return are skipped instead of voiding
+        the window.
+    """
+    values = np.asarray(values, dtype=float)
+    benchmark = np.asarray(benchmark, dtype=float)
+    if values.size == 0:
+        return {column: np.full(values.shape[1] if values.ndim == 2 else 0, np.nan) for column in RISK_COLUMNS}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        portfolio = values[1:] / values[:-1] - 1
+        market = benchmark[1:] / benchmark[:-1] - 1
+    portfolio[~np.isfinite(portfolio)] = np.nan
+    market[~np.isfinite(market)] = np.nan
+    paired = ~np.isnan(portfolio) & ~np.isnan(market)
+    market = np.where(paired, market, np.nan)
+
+    rf = (1 + risk_free_rate) ** (1 / periods_per_year) - 1
+    excess = portfolio - rf
+    annualizer = np.sqrt(periods_per_year)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns just yield NaN
+        mean_excess = np.nanmean(excess, axis=0)
+        downside = np.sqrt(np.nanmean(np.minimum(excess, 0) ** 2, axis=0))
+        paired_portfolio = np.where(paired, portfolio, np.nan)
+        deviations = (paired_portfolio - np.nanmean(paired_portfolio, axis=0)) * (market - np.nanmean(market, axis=0))
+        beta = np.nansum(deviations, axis=0) / (paired.sum(axis=0) - 1) / np.nanvar(market, axis=0, ddof=1)
+        peaks = np.fmax.accumulate(values, axis=0)
+        metrics = {
+            "sharpe_ratio": mean_excess / np.nanstd(excess, axis=0, ddof=1),
+            "sortino_ratio": mean_excess / downside,
+            "volatility": np.nanstd(portfolio, axis=0, ddof=1) * annualizer,
+            "max_drawdown": np.nanmin(values / peaks - 1, axis=0),
+            "beta": beta,
+            "alpha": (mean_excess - beta * np.nanmean(market - rf, axis=0)) * periods_per_year,
+            "tracking_error": np.nanstd(portfolio - market, axis=0, ddof=1) * annualizer,
+        }
+    return {column: np.where(np.isfinite(metric), metric, np.nan) for column, metric in metrics.items()}
+
+
+def to_records(frame: pd.DataFrame, columns=RISK_COLUMNS, required: str = "sharpe_ratio") -> list:
+    """Serialize rows where `required` is defined; other undefined metrics become None."""
+    frame = frame.loc[frame[required].notna().to_numpy(), list(columns)]
+    return [
+        {"date": date, **{column: None if np.isnan(value) else float(value) for column, value in zip(columns, row)}}
+        for date, row in zip(frame.index, frame.to_numpy(dtype=float))
+    ]
@@ -0,0 +1,310 @@
+"""
+What-if scenarios valued in batches against the shared price matrices.
+
+A scenario is either a holdings set (explicit rows, or a registered portfolio with sectors or
+tickers excluded) or a set of target weights rebalanced at a fixed frequency. Weight scenarios are
+stepped through the monthly price grid together, one (scenarios x tickers) array operation per
+month, and every scenario is then valued in one batch_portfolio_values pass and scored with
+risk.period_risk. Large batches are split across a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import downsample
+import portfolios
+import risk
+from price_store import PriceMatrix
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK = "^GSPC"
+MAX_SCENARIOS = int(os.getenv("MAX_SCENARIOS", "1000"))
+# Batches at least this large are spread over SCENARIO_WORKERS processes
+SCENARIO_POOL_THRESHOLD = int(os.getenv("SCENARIO_POOL_THRESHOLD", "200"))
+SCENARIO_WORKERS = int(os.getenv("SCENARIO_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_INITIAL_VALUE = 100_000.0
+# Months between rebalances; "none" buys once and holds
+REBALANCE_MONTHS = {"none": 0, "monthly": 1, "quarterly": 3, "semiannual": 6, "annual": 12}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_scenarios(payload: dict, sectors: dict) -> list:
+    """
+    Validate a /scenarios request body into scenario specs, resolving portfolio-based scenarios to
+    holdings frames. Raises ValueError on the first invalid scenario.
+    """
+    specs = payload.get("scenarios")
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("scenarios must be a non-empty list")
+    if len(specs) > MAX_SCENARIOS:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios per request")
+    return [_parse_scenario(i, spec, sectors) for i, spec in enumerate(specs)]
+
+
+def _parse_scenario(i: int, spec: dict, sectors: dict) -> dict:
+    if not isinstance(spec, dict):
+        raise ValueError(f"Scenario {i} must be an object")
+    name = str(spec.get("name", f"scenario-{i}"))
+    try:
+        start = pd.Timestamp(spec["start"]).strftime("%Y-%m-%d") if spec.get("start") else None
+        end = pd.Timestamp(spec["end"]).strftime("%Y-%m-%d") if spec.get("end") else None
+    except ValueError as e:
+        raise ValueError(f"Scenario {name}: invalid date: {e}") from e
+    excluded = set(spec.get("exclude_tickers") or [])
+    excluded_sectors = set(spec.get("exclude_sectors") or [])
+
+    # Portfolio scenarios, and equal weights without a ticker list, start from a registered portfolio
+    weights = spec.get("weights")
+    base = None
+    needs_base = (weights is None and "holdings" not in spec) or (weights == "equal" and not spec.get("tickers"))
+    if "portfolio" in spec or needs_base:
+        portfolio_id = spec.get("portfolio", portfolios.DEFAULT_PORTFOLIO)
+        base = portfolios.registry.get(portfolio_id)
+        if base is None:
+            raise ValueError(f"Scenario {name}: unknown portfolio {portfolio_id}")
+
+    def keep(tickers) -> np.ndarray:
+        tickers = np.asarray(tickers, dtype=object)
+        return ~np.isin(tickers, list(excluded)) & ~np.isin(
+            [sectors.get(ticker, analytics.UNKNOWN_SECTOR) for ticker in tickers], list(excluded_sectors)
+        )
+
+    if weights is not None:
+        if weights == "equal":
+            universe = spec.get("tickers") or sorted(map(str, base["Symbol"].unique()))
+            weights = {ticker: 1.0 for ticker in universe}
+        if not isinstance(weights, dict) or not weights:
+            raise ValueError(f"Scenario {name}: weights must be a {{ticker: weight}} object or \"equal\"")
+        try:
+            weights = {str(ticker): float(weight) for ticker, weight in weights.items()}
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Scenario {name}: invalid weight: {e}") from e
+        if any(weight < 0 for weight in weights.values()):
+            raise ValueError(f"Scenario {name}: weights must not be negative")
+        tickers = np.asarray(list(weights), dtype=object)
+        weights = {ticker: weights[ticker] for ticker in tickers[keep(tickers)]}
+        if not sum(weights.values()) > 0:
+            raise ValueError(f"Scenario {name}: no weight left after exclusions")
+        rebalance = spec.get("rebalance", "monthly")
+        if rebalance not in REBALANCE_MONTHS:
+            raise ValueError(f"Scenario {name}: rebalance must be one of {', '.join(REBALANCE_MONTHS)}")
+        try:
+            initial_value = float(spec.get("initial_value", DEFAULT_INITIAL_VALUE))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Scenario {name}: invalid initial_value: {e}") from e
+        if not initial_value > 0:
+            raise ValueError(f"Scenario {name}: initial_value must be positive")
+        if start is None and base is not None:
+            start = analytics.format_dates(base["Date"].iloc[:1].to_numpy())[0]
+        return {
+            "name": name, "weights": weights, "rebalance": REBALANCE_MONTHS[rebalance],
+            "initial_value": initial_value, "start": start, "end": end,
+        }
+
+    if "holdings" in spec:
+        rows = spec["holdings"]
+        try:
+            if isinstance(rows, str):
+                holdings = portfolios.parse_holdings_csv(rows)
+            else:
+                holdings = portfolios.prepare_holdings(pd.DataFrame(rows))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Scenario {name}: {e}") from e
+    else:
+        holdings = base
+    mask = keep(holdings["Symbol"].astype(str).to_numpy())
+    if start:
+        mask &= (holdings["Date"] >= pd.Timestamp(start)).to_numpy()
+    if end:
+        mask &= (holdings["Date"] <= pd.Timestamp(end)).to_numpy()
+    return {"name": name, "holdings": holdings[mask].reset_index(drop=True)}
+
+
+def rebalanced_holdings(specs: list, prices: PriceMatrix) -> dict:
+    """
+    Holdings for weight scenarios on the monthly price grid: {index in specs: holdings frame}.
+
+    All scenarios advance through the grid together. On each scenario's rebalance months its current
+    value is split over the tickers that have a price, by weight, at that month's closes; shares
+    are carried unchanged in between. A scenario is invested from the first month on or after its
+    start where any of its tickers has a price.
+    """
+    if not specs:
+        return {}
+    tickers = sorted({ticker for spec in specs for ticker in spec["weights"]})
+    column = {ticker: j for j, ticker in enumerate(tickers)}
+    weights = np.zeros((len(specs), len(tickers)))
+    for s, spec in enumerate(specs):
+        for ticker, weight in spec["weights"].items():
+            weights[s, column[ticker]] = weight
+
+    grid = np.asarray(prices.dates, dtype=object)
+    grid_prices = analytics.align_prices(prices, grid, tickers)
+    months = np.array([int(date[:4]) * 12 + int(date[5:7]) for date in grid])
+    first_rows = np.searchsorted(grid, [spec["start"] or "" for spec in specs], side="left")
+    last_rows = np.searchsorted(grid, [spec["end"] or "9999" for spec in specs], side="right")
+    periods = np.array([spec["rebalance"] for spec in specs])
+    initial = np.array([spec["initial_value"] for spec in specs])
+
+    shares = np.zeros((len(specs), len(tickers)))
+    invested_month = np.full(len(specs), -1)
+    rows, scenario_codes, ticker_codes, share_values = [], [], [], []
+    for d in range(len(grid)):
+        active = (first_rows <= d) & (d < last_rows)
+        if not active.any():
+            continue
+        priced = ~np.isnan(grid_prices[d])
+        closes = np.nan_to_num(grid_prices[d])
+        invested = invested_month >= 0
+        # Missing prices count as 0, as in Valuation
+        value = np.where(invested, shares @ closes, initial)
+        since = months[d] - invested_month
+        due = active & (~invested | ((periods > 0) & (since % np.maximum(periods, 1) == 0)))
+        target = weights[due] * priced
+        totals = target.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            target = np.where(totals > 0, target / totals, 0.0)
+        fundable = totals[:, 0] > 0
+        due_rows = np.flatnonzero(due)[fundable]
+        shares[due_rows] = value[due_rows, None] * target[fundable] / np.where(priced, closes, 1.0)
+        invested_month[due_rows[invested_month[due_rows] < 0]] = months[d]
+        shares[~active] = 0.0
+
+        held_s, held_t = np.nonzero(shares)
+        rows.append(np.full(len(held_s), d))
+        scenario_codes.append(held_s)
+        ticker_codes.append(held_t)
+        share_values.append(shares[held_s, held_t])
+
+    if not rows:
+        rows = scenario_codes = ticker_codes = share_values = [np.zeros(0, dtype=int)]
+    rows, scenario_codes = np.concatenate(rows), np.concatenate(scenario_codes)
+    ticker_codes, share_values = np.concatenate(ticker_codes), np.concatenate(share_values)
+    order = np.argsort(scenario_codes, kind="stable")
+    bounds = np.searchsorted(scenario_codes[order], np.arange(len(specs) + 1))
+    # Dates are parsed and the symbol dtype built once, not once per scenario
+    grid_dates = pd.to_datetime(grid).to_numpy()
+    symbols = pd.CategoricalDtype(tickers)
+    holdings = {}
+    for s in range(len(specs)):
+        part = order[bounds[s]:bounds[s + 1]]
+        holdings[s] = pd.DataFrame({
+            "Date": grid_dates[rows[part]],
+            "Symbol": pd.Categorical.from_codes(ticker_codes[part], dtype=symbols),
+            "Shares": share_values[part],
+        })
+    return holdings
+
+
+def evaluate(specs: list, context: dict) -> list:
+    """
+    Value and score a batch of parsed scenarios. context holds the resolution's price matrix
+    ("prices"), the monthly matrix for rebalancing ("monthly"), "periods_per_year",
+    "risk_free_rate", and "series"/"max_points" for the optional value series.
+    """
+    prices = context["prices"]
+    weighted = [s for s, spec in enumerate(specs) if "weights" in spec]
+    holdings = {s: spec["holdings"] for s, spec in enumerate(specs) if "holdings" in spec}
+    built = rebalanced_holdings([specs[s] for s in weighted], context["monthly"])
+    holdings.update({weighted[k]: frame for k, frame in built.items()})
+    step = context["resolution"] != "monthly"
+    values = analytics.batch_portfolio_values(holdings, prices, step_holdings=step)
+
+    # One (dates x scenarios) grid over every scenario's valuation dates, NaN outside each one's range
+    axis = pd.Index(sorted({date for dates, _ in values.values() for date in dates}), dtype=object)
+    grid = np.full((len(axis), len(specs)), np.nan)
+    for s, (dates, series) in values.items():
+        grid[axis.get_indexer(dates), s] = series
+    benchmark_column = analytics.align_prices(prices, axis, [BENCHMARK])[:, 0]
+    benchmark = np.where(np.isnan(grid), np.nan, benchmark_column[:, None])
+    scores = risk.period_risk(grid, benchmark, context["periods_per_year"], context["risk_free_rate"])
+
+    results = []
+    for s, spec in enumerate(specs):
+        # One scenario that can't be scored is reported on its own instead of failing the batch
+        try:
+            scored = {column: scores[column][s] for column in scores}
+            results.append(_result(spec, values[s], benchmark[:, s], scored, context))
+        except Exception as e:
+            logger.error(f"Error evaluating scenario {spec['name']}: {e}")
+            results.append({"name": spec["name"], "error": "Failed to evaluate scenario"})
+    return results
+
+
+def _result(spec: dict, values, benchmark, scores: dict, context: dict) -> dict:
+    dates, series = values
+    result = {"name": spec["name"], "start": None, "end": None}
+    if len(series):
+        paired = np.flatnonzero(~np.isnan(benchmark))
+        result.update(_returns(dates, series, benchmark, paired, context["periods_per_year"]))
+    if not len(series) or not np.any(series > 0):
+        # Nothing was ever priced (e.g. tickers not ingested yet), so there is nothing to score
+        result["error"] = "No prices for this scenario's holdings"
+        scores = {}
+    result.update({column: _number(scores.get(column)) for column in risk.RISK_COLUMNS})
+    if context.get("series"):
+        records = [{"date": date, "value": round(float(value), 2)} for date, value in zip(dates, series)]
+        result["values"] = downsample.downsample_records(records, context.get("max_points"), "value")
+    return result
+
+
+def _number(value):
+    return None if value is None or not np.isfinite(value) else round(float(value), 6)
+
+
+def _returns(dates, series, benchmark, paired, periods_per_year: int) -> dict:
+    """Start/end values, total and annualized return, and the benchmark's return over the same dates."""
+    invested = np.flatnonzero(series > 0)
+    first = invested[0] if len(invested) else 0
+    start_value, end_value = float(series[first]), float(series[-1])
+    periods = len(series) - 1 - first
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total_return = end_value / start_value - 1 if start_value else np.nan
+        annualized = (1 + total_return) ** (periods_per_year / periods) - 1 if periods > 0 else np.nan
+        benchmark_return = np.divide(benchmark[paired[-1]], benchmark[paired[0]]) - 1 if len(paired) else np.nan
+    return {
+        "start": dates[0],
+        "end": dates[-1],
+        "start_value": round(start_value, 2),
+        "end_value": round(end_value, 2),
+        "total_return": _number(total_return),
+        "annualized_return": _number(annualized),
+        "benchmark_return": _number(benchmark_return),
+        "excess_return": _number(total_return - benchmark_return),
+    }
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process runs scheduler and client threads
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def run(specs: list, context: dict, workers: int = SCENARIO_WORKERS, threshold: int = SCENARIO_POOL_THRESHOLD) -> list:
+    """Evaluate specs in this process, or split into one chunk per worker process for large batches."""
+    if workers <= 1 or len(specs) < threshold:
+        return evaluate(specs, context)
+    chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(specs)), workers) if len(chunk)]
+    pool = _get_pool(workers)
+    futures = [pool.submit(evaluate, [specs[s] for s in chunk], context) for chunk in chunks]
+    return [result for future in futures for result in future.result()]
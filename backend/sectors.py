@@ -0,0 +1,84 @@
+"""
+Persistent sector metadata cache.
+
+Sectors are kept in a JSON file under DATA_DIR with a fetch timestamp per ticker, so restarts
+reuse what was already looked up. Missing or expired entries are filled concurrently from Yahoo
+Finance on a bounded worker pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import threading
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_SECTOR = "Unknown"
+SECTOR_TTL_SECONDS = int(os.getenv("SECTOR_TTL_DAYS", "30")) * 86400
+# Failed lookups are retried sooner than real classifications expire
+UNKNOWN_TTL_SECONDS = int(os.getenv("SECTOR_UNKNOWN_TTL_DAYS", "1")) * 86400
+SECTOR_WORKERS = int(os.getenv("SECTOR_WORKERS", "8"))
+
+
+class SectorCache:
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(db.DATA_DIR, "sectors.json")
+        self._entries = {}  # {ticker: {"sector": str, "fetched_at": epoch seconds}}
+        self._lock = threading.Lock()
+        self._populate_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable sector cache {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            entries = dict(self._entries)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def mapping(self) -> dict:
+        """Return {ticker: sector} for every cached ticker."""
+        with self._lock:
+            return {ticker: entry["sector"] for ticker, entry in self._entries.items()}
+
+    def stale(self, tickers, now: float = None) -> list:
+        """Tickers that are missing from the cache or whose entry has expired."""
+        now = now or time.time()
+        expired = []
+        for ticker in tickers:
+            entry = self._entries.get(ticker)
+            ttl = UNKNOWN_TTL_SECONDS if entry and entry["sector"] == UNKNOWN_SECTOR else SECTOR_TTL_SECONDS
+            if entry is None or now - entry["fetched_at"] > ttl:
+                expired.append(ticker)
+        return expired
+
+    def populate(self, tickers, workers: int = SECTOR_WORKERS) -> int:
+        """Fetch missing or expired sectors concurrently and persist them. Returns the number fetched."""
+        with self._populate_lock:
+            pending = self.stale(tickers)
+            if not pending:
+                return 0
+            logger.info(f"Fetching sectors for {len(pending)} tickers...")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for ticker, sector in zip(pending, executor.map(db.get_stock_sector, pending)):
+                    with self._lock:
+                        self._entries[ticker] = {"sector": sector, "fetched_at": time.time()}
+            self.save()
+            logger.info(f"Sector cache populated with {len(pending)} tickers.")
+            return len(pending)
+
+
+cache = SectorCache()
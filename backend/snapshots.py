@@ -0,0 +1,183 @@
+"""
+Precomputed, pre-compressed analytics payloads.
+
+After each ingestion the endpoint payloads are serialized once into a versioned snapshot. The
+middleware serves those bytes directly, gzip- or brotli-compressed to match Accept-Encoding, with
+a strong ETag per encoding, and answers 304 when the browser already has the current copy.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from fastapi.encoders import jsonable_encoder
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def serialize(data) -> bytes:
+    """Serialize a payload the same way FastAPI's JSONResponse does."""
+    return json.dumps(
+        jsonable_encoder(data), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def is_error(body: bytes) -> bool:
+    """Endpoints report failures as a 200 {"error": ...} body; those must never be snapshotted."""
+    return body.startswith(b'{"error":')
+
+
+class Payload:
+    """One serialized response body plus its compressed variants, each with its own strong ETag."""
+
+    def __init__(self, body: bytes):
+        self.encodings = {"identity": body, "gzip": gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(body)
+        # Strong validators must differ when the bytes do, so compressed variants get a suffix
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.encodings
+        }
+
+
+class Snapshot:
+    def __init__(self, version: int, payloads: dict = None):
+        self.version = version
+        self.created_at = time.time()
+        self.payloads = payloads or {}
+
+
+class SnapshotStore:
+    def __init__(self):
+        self._snapshot = Snapshot(0)
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Snapshot:
+        return self._snapshot
+
+    def put(self, path: str, body: bytes, version: int) -> Payload:
+        """Add a lazily computed payload, unless a newer snapshot was published meanwhile."""
+        payload = Payload(body)
+        with self._lock:
+            if self._snapshot.version == version:
+                self._snapshot.payloads[path] = payload
+        return payload
+
+    def publish(self, payloads: dict) -> Snapshot:
+        with self._lock:
+            snapshot = Snapshot(self._snapshot.version + 1, payloads)
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self, *paths) -> Snapshot:
+        """Publish the current payloads without `paths`, which are then recomputed on their next request."""
+        with self._lock:
+            payloads = {path: payload for path, payload in self._snapshot.payloads.items() if path not in paths}
+            snapshot = Snapshot(self._snapshot.version + 1, payloads)
+            self._snapshot = snapshot
+        return snapshot
+
+    def materialize(self, builders: dict) -> Snapshot:
+        """
+        Run every builder ({path: async fn}) and publish the results as a new snapshot.
+
+        Called from worker threads (ingestion, scheduler), so it runs its own event loop.
+        Builders that fail are left out and get computed on first request instead.
+        """
+        started = time.perf_counter()
+
+        async def build_all():
+            return await asyncio.gather(*(build() for build in builders.values()), return_exceptions=True)
+
+        payloads = {}
+        for path, result in zip(builders, asyncio.run(build_all())):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to materialize {path}: {result}")
+                continue
+            body = serialize(result)
+            if is_error(body):
+                logger.error(f"Not materializing {path}: {result['error']}")
+                continue
+            payloads[path] = Payload(body)
+        snapshot = self.publish(payloads)
+        logger.info(
+            f"Published analytics snapshot v{snapshot.version} with {len(payloads)} payloads "
+            f"in {time.perf_counter() - started:.2f}s."
+        )
+        return snapshot
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """Pick br, then gzip, then identity from an Accept-Encoding header."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+class SnapshotMiddleware(BaseHTTPMiddleware):
+    """Serve GET requests for snapshot paths (without query parameters) from the snapshot store."""
+
+    def __init__(self, app, store: SnapshotStore, paths):
+        super().__init__(app)
+        self.store = store
+        self.paths = set(paths)
+
+    async def dispatch(self, request, call_next):
+        path = request.url.path
+        if request.method != "GET" or path not in self.paths or request.url.query:
+            return await call_next(request)
+
+        snapshot = self.store.current
+        payload = snapshot.payloads.get(path)
+        metrics.record_cache("snapshot", payload is not None)
+        if payload is None:
+            response = await call_next(request)
+            if response.status_code != 200:
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            if is_error(body):
+                # A transient failure would otherwise be served until the next data version
+                return Response(body, status_code=response.status_code, headers=dict(response.headers))
+            payload = self.store.put(path, body, snapshot.version)
+
+        # Answered before routing, so tell the metrics middleware which route this was
+        request.scope["snapshot_path"] = path
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), payload.encodings)
+        headers = {
+            "ETag": payload.etags[encoding],
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+            "X-Snapshot-Version": str(snapshot.version),
+        }
+        if_none_match = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+        if payload.etags[encoding] in if_none_match or "*" in if_none_match:
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(payload.encodings[encoding], media_type="application/json", headers=headers)
+
+
+store = SnapshotStore()
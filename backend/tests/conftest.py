@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The backend is a flat set of modules imported by name, as mains.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from price_store import PriceMatrix  # noqa: E402
+
+TICKERS = ["AAA", "BBB", "CCC", "DDD", "EEE"]
+
+
+def make_holdings(seed: int, months: int = 18, tickers=TICKERS) -> pd.DataFrame:
+    """Random monthly holdings with integer shares; tickers come and go between months."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-01", periods=months, freq="MS")
+    rows = [
+        (date, ticker, int(rng.integers(1, 50)))
+        for date in dates
+        for ticker in tickers
+        if rng.random() < 0.75
+    ]
+    return pd.DataFrame(rows, columns=["Date", "Symbol", "Shares"])
+
+
+@pytest.fixture
+def prices() -> PriceMatrix:
+    """Daily prices on business days, so every holdings month start has a price."""
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2020-01-01", "2021-12-31", freq="D")
+    frame = pd.DataFrame(
+        50 * np.exp(np.cumsum(rng.normal(0, 0.01, (len(dates), len(TICKERS))), axis=0)),
+        index=dates.strftime("%Y-%m-%d"),
+        columns=TICKERS,
+    )
+    return PriceMatrix.from_frame(frame)
+
+
+@pytest.fixture
+def monthly_prices(prices) -> PriceMatrix:
+    """Month-start rows of the daily prices, like the monthly price matrix."""
+    frame = pd.DataFrame(prices.values, index=prices.dates, columns=prices.tickers)
+    return PriceMatrix.from_frame(frame[[date.endswith("-01") for date in prices.dates]])
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+import portfolios
+from conftest import make_holdings
+
+
+def edit_shares(holdings):
+    holdings = holdings.copy()
+    holdings.loc[holdings.index[12], "Shares"] += 7
+    return holdings
+
+
+def drop_month(holdings):
+    return holdings[holdings["Date"] != pd.Timestamp("2020-08-01")]
+
+
+def add_position(holdings):
+    extra = pd.DataFrame({"Date": [pd.Timestamp("2020-03-01")], "Symbol": ["ZZZ"], "Shares": [5]})
+    return pd.concat([holdings, extra], ignore_index=True)
+
+
+def append_month(holdings):
+    last = holdings[holdings["Date"] == holdings["Date"].max()].copy()
+    last["Date"] = last["Date"].max() + pd.offsets.MonthBegin()
+    return pd.concat([holdings, last], ignore_index=True)
+
+
+def drop_last_month(holdings):
+    return holdings[holdings["Date"] != holdings["Date"].max()]
+
+
+EDITS = [edit_shares, drop_month, add_position, append_month, drop_last_month]
+
+
+def prepared(frame):
+    return portfolios.prepare_holdings(frame)
+
+
+@pytest.mark.parametrize("edit", EDITS)
+@pytest.mark.parametrize("step_holdings", [False, True])
+def test_revalue_portfolio_matches_full_valuation(prices, monthly_prices, edit, step_holdings):
+    matrix = prices if step_holdings else monthly_prices
+    old = prepared(make_holdings(1))
+    new = prepared(edit(old))
+    previous = analytics.batch_portfolio_values({0: old}, matrix, step_holdings)[0]
+
+    dates, values = analytics.revalue_portfolio(
+        previous, new, matrix, portfolios.changed_dates(old, new), step_holdings
+    )
+
+    expected_dates, expected_values = analytics.batch_portfolio_values({0: new}, matrix, step_holdings)[0]
+    assert dates == list(expected_dates)
+    np.testing.assert_allclose(values, expected_values)
+
+
+@pytest.mark.parametrize("edit", EDITS)
+def test_updated_batch_matches_rebuilt_batch(monthly_prices, edit):
+    old = {"a": prepared(make_holdings(1)), "b": prepared(make_holdings(2))}
+    batch = analytics.ValuationBatch(old, monthly_prices)
+    batch.get("a").trades  # earlier trades are what the incremental path reuses
+    new = {"a": prepared(edit(old["a"])), "b": old["b"]}
+
+    updated = batch.updated(new, {"a": portfolios.changed_dates(old["a"], new["a"])})
+
+    rebuilt = analytics.ValuationBatch(new, monthly_prices)
+    for portfolio_id in new:
+        assert updated.values[portfolio_id][0] == rebuilt.values[portfolio_id][0]
+        np.testing.assert_allclose(updated.values[portfolio_id][1], rebuilt.values[portfolio_id][1])
+        pd.testing.assert_frame_equal(updated.get(portfolio_id).trades, rebuilt.get(portfolio_id).trades)
+
+
+def test_incremental_trades_match_full_trades(monthly_prices):
+    old = prepared(make_holdings(3))
+    new = prepared(drop_month(edit_shares(old)))
+    earlier = analytics.Valuation(old, monthly_prices)
+    earlier.trades
+    changed = analytics.format_dates(portfolios.changed_dates(old, new))
+
+    incremental = analytics.Valuation(new, monthly_prices, previous=(earlier, changed)).trades
+
+    pd.testing.assert_frame_equal(incremental, analytics.Valuation(new, monthly_prices).trades)
+
+
+def test_page_trades_cursor_round_trip(monthly_prices):
+    trades = analytics.Valuation(prepared(make_holdings(4)), monthly_prices).trades_newest_first
+    pages, cursor = [], None
+    while True:
+        page, cursor = analytics.page_trades(trades, 7, cursor)
+        pages.append(page)
+        if cursor is None:
+            break
+
+    assert len(pages) == -(-len(trades) // 7)
+    pd.testing.assert_frame_equal(pd.concat(pages), trades)
+
+
+def test_cursor_encoding():
+    assert analytics.decode_cursor(analytics.encode_cursor("2020-01-01", "BRK-B")) == ("2020-01-01", "BRK-B")
+    with pytest.raises(ValueError):
+        analytics.decode_cursor("not a cursor")
+
+
+def test_filter_trades_bounds_are_inclusive_iso_dates(monthly_prices):
+    trades = analytics.Valuation(prepared(make_holdings(4)), monthly_prices).trades
+
+    filtered = analytics.filter_trades(trades, start="2020-03-01", end="2020-05-01", trade_type="sell")
+
+    assert set(filtered["Date"]) <= {"2020-03-01", "2020-04-01", "2020-05-01"}
+    assert (filtered["Type"] == "SELL").all()
+    for bad in ({"start": "2020-1-5"}, {"end": "2020"}, {"trade_type": "HOLD"}):
+        with pytest.raises(ValueError):
+            analytics.filter_trades(trades, **bad)
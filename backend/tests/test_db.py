@@ -0,0 +1,30 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import db
+
+
+def test_first_fetch_includes_the_bar_before_the_default_start():
+    plan = db.plan_stock_fetch(["AAA", "BBB"], {}, today=datetime.date(2024, 1, 10))
+
+    assert plan == [("2014-12-31", ["AAA", "BBB"])]
+
+
+def test_fetch_resumes_from_each_watermark():
+    watermarks = {"AAA": "2024-01-05", "BBB": "2024-01-10"}
+
+    plan = db.plan_stock_fetch(["AAA", "BBB", "CCC"], watermarks, today=datetime.date(2024, 1, 10))
+
+    assert plan == [("2014-12-31", ["CCC"]), ("2024-01-05", ["AAA"])]
+
+
+def test_group_bar_dates_returns_unique_sorted_days():
+    times = pd.Series(pd.to_datetime(["2024-01-03 16:00", "2024-01-02 09:30", "2024-01-03 00:00", "2024-01-02 00:00"]))
+
+    grouped = db.group_bar_dates(pd.Series(["AAA", "AAA", "AAA", "BBB"]), times)
+
+    np.testing.assert_array_equal(grouped["AAA"], np.array(["2024-01-02", "2024-01-03"], dtype="datetime64[D]"))
+    assert grouped["AAA"].dtype == np.dtype("datetime64[D]")
+    assert list(grouped) == ["AAA", "BBB"]
@@ -0,0 +1,109 @@
+from collections import deque
+
+import pytest
+
+import analytics
+import ledger
+import portfolios
+from conftest import make_holdings
+
+
+def brute_force(trades, method):
+    """Replay every trade from scratch: {ticker: (shares, cost, realized)}."""
+    lots, realized = {}, {}
+    for trade in trades.to_dict("records"):
+        ticker, quantity, price = trade["Ticker"], trade["Quantity"], trade["UnitPrice"]
+        open_lots = lots.setdefault(ticker, deque())
+        realized.setdefault(ticker, 0.0)
+        if trade["Type"] == "BUY":
+            if method == "average" and open_lots:
+                shares = open_lots[0][0] + quantity
+                open_lots[0] = [shares, (open_lots[0][0] * open_lots[0][1] + quantity * price) / shares]
+            else:
+                open_lots.append([quantity, price])
+            continue
+        while quantity > 0 and open_lots:
+            lot = open_lots[-1] if method == "lifo" else open_lots[0]
+            sold = min(quantity, lot[0])
+            realized[ticker] += sold * (price - lot[1])
+            lot[0] -= sold
+            quantity -= sold
+            if lot[0] == 0:
+                open_lots.remove(lot)
+    return {
+        ticker: (sum(q for q, _ in lots[ticker]), sum(q * p for q, p in lots[ticker]), realized[ticker])
+        for ticker in lots
+    }
+
+
+def positions(lot_ledger):
+    return {
+        ticker: (position.shares, position.cost, position.realized)
+        for ticker, position in lot_ledger.snapshot().items()
+    }
+
+
+def assert_same(actual, expected):
+    assert actual.keys() == expected.keys()
+    for ticker, values in expected.items():
+        assert actual[ticker] == pytest.approx(values, abs=1e-6), ticker
+
+
+def trades_for(seed, monthly_prices, edit=None):
+    holdings = make_holdings(seed)
+    if edit is not None:
+        holdings = edit(holdings)
+    return analytics.Valuation(portfolios.prepare_holdings(holdings), monthly_prices).trades
+
+
+def edit_middle_month(holdings):
+    holdings = holdings.copy()
+    holdings.loc[holdings["Date"] == "2020-09-01", "Shares"] += 3
+    return holdings
+
+
+@pytest.mark.parametrize("method", ledger.COST_BASIS_METHODS)
+def test_sync_matches_brute_force(tmp_path, monthly_prices, method):
+    trades = trades_for(5, monthly_prices)
+    lot_ledger = ledger.LotLedger(method, str(tmp_path / "ledger.json"))
+
+    lot_ledger.sync(trades)
+
+    assert_same(positions(lot_ledger), brute_force(trades, method))
+
+
+@pytest.mark.parametrize("method", ledger.COST_BASIS_METHODS)
+def test_incremental_sync_matches_single_sync(tmp_path, monthly_prices, method):
+    trades = trades_for(6, monthly_prices)
+    lot_ledger = ledger.LotLedger(method, str(tmp_path / "ledger.json"))
+
+    for end in ("2020-04-01", "2020-11-01", "2021-06-01"):
+        lot_ledger.sync(trades[trades["Date"] <= end])
+
+    assert_same(positions(lot_ledger), brute_force(trades, method))
+
+
+@pytest.mark.parametrize("method", ledger.COST_BASIS_METHODS)
+def test_edited_history_rewinds_to_checkpoint(tmp_path, monthly_prices, method):
+    lot_ledger = ledger.LotLedger(method, str(tmp_path / "ledger.json"))
+    lot_ledger.sync(trades_for(7, monthly_prices))
+    edited = trades_for(7, monthly_prices, edit_middle_month)
+
+    lot_ledger.sync(edited)
+
+    assert_same(positions(lot_ledger), brute_force(edited, method))
+    # Checkpoints from before the edit were not mutated by the replay
+    lot_ledger.sync(trades_for(7, monthly_prices))
+    assert_same(positions(lot_ledger), brute_force(trades_for(7, monthly_prices), method))
+
+
+@pytest.mark.parametrize("method", ledger.COST_BASIS_METHODS)
+def test_saved_state_resumes(tmp_path, monthly_prices, method):
+    path = str(tmp_path / "ledger.json")
+    trades = trades_for(8, monthly_prices)
+    ledger.LotLedger(method, path).sync(trades[trades["Date"] <= "2020-10-01"])
+
+    resumed = ledger.LotLedger(method, path)
+    resumed.sync(trades)
+
+    assert_same(positions(resumed), brute_force(trades, method))
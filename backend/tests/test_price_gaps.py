@@ -0,0 +1,42 @@
+import numpy as np
+
+import price_gaps
+
+
+def days(*values):
+    return np.array(values, dtype="datetime64[D]")
+
+
+def test_merge_ranges_splits_at_non_consecutive_sessions():
+    sessions = price_gaps.trading_sessions("2024-03-25", "2024-04-12")
+    # 2024-03-29 is Good Friday, so the 28th and 1st are consecutive sessions
+    missing = days("2024-03-26", "2024-03-27", "2024-03-28", "2024-04-01", "2024-04-05", "2024-04-10")
+
+    ranges = price_gaps.merge_ranges(missing, sessions)
+
+    assert ranges == [
+        (np.datetime64("2024-03-26"), np.datetime64("2024-04-01")),
+        (np.datetime64("2024-04-05"), np.datetime64("2024-04-05")),
+        (np.datetime64("2024-04-10"), np.datetime64("2024-04-10")),
+    ]
+
+
+def test_find_gaps_only_reports_interior_sessions():
+    sessions = price_gaps.trading_sessions("2024-01-02", "2024-01-31")
+    stored = np.setdiff1d(sessions[:15], days("2024-01-09", "2024-01-10"))
+
+    gaps = price_gaps.find_gaps({"AAA": stored, "BBB": sessions[:15]}, ["AAA", "BBB"], today="2024-02-15")
+
+    assert list(gaps) == ["AAA"]
+    missing, ranges = gaps["AAA"]
+    np.testing.assert_array_equal(missing, days("2024-01-09", "2024-01-10"))
+    assert ranges == [(np.datetime64("2024-01-09"), np.datetime64("2024-01-10"))]
+
+
+def test_find_gaps_skips_unavailable_sessions():
+    sessions = price_gaps.trading_sessions("2024-01-02", "2024-01-31")
+    stored = np.setdiff1d(sessions, days("2024-01-09"))
+
+    gaps = price_gaps.find_gaps({"AAA": stored}, ["AAA"], {"AAA": ["2024-01-09"]}, today="2024-02-15")
+
+    assert gaps == {}
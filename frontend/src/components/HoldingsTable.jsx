@@ -3,6 +3,9 @@ import axios from "axios";
 
 const API_BASE_URL = "http://localhost:8000";
 
+// Tickers without a stored close yet come back unpriced
+const formatDollars = (value) => (value == null ? "N/A" : `$${value.toFixed(2)}`);
+
 const HoldingsTable = () => {
   const [holdings, setHoldings] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -10,7 +13,8 @@ const HoldingsTable = () => {
   useEffect(() => {
     axios.get(`${API_BASE_URL}/holdings`)
       .then((response) => {
-        setHoldings(response.data);
+        // Keep rows the live stream may already have delivered
+        setHoldings((current) => (current.length ? current : response.data));
       })
       .catch((error) => {
         console.error("Error fetching holdings:", error);
@@ -20,6 +24,25 @@ const HoldingsTable = () => {
       });
   }, []);
 
+  // Live mode pushes changed rows; the backend answers 204 (no retries) when it's off
+  useEffect(() => {
+    const source = new EventSource(`${API_BASE_URL}/holdings/stream`);
+    source.addEventListener("holdings", (event) => {
+      const updates = JSON.parse(event.data);
+      setHoldings((current) => {
+        const rows = new Map(current.map((holding) => [holding.ticker, holding]));
+        updates.forEach((holding) => rows.set(holding.ticker, holding));
+        return [...rows.values()].sort((a, b) => (a.ticker < b.ticker ? -1 : 1));
+      });
+      setLoading(false);
+    });
+    source.addEventListener("removed", (event) => {
+      const removed = new Set(JSON.parse(event.data));
+      setHoldings((current) => current.filter((holding) => !removed.has(holding.ticker)));
+    });
+    return () => source.close();
+  }, []);
+
   if (loading) {
     return (
         <div style={{
@@ -57,12 +80,12 @@ const HoldingsTable = () => {
                 <td>{holding.ticker}</td>
                 <td>{holding.quantity}</td>
                 <td style={{ color: holding.day_change >= 0 ? "green" : "red" }}>
-                  ${holding.day_change.toFixed(2)}
+                  {formatDollars(holding.day_change)}
                 </td>
                 <td style={{ color: holding.total_change >= 0 ? "green" : "red" }}>
-                  ${holding.total_change.toFixed(2)}
+                  {formatDollars(holding.total_change)}
                 </td>
-                <td>${holding.market_value.toFixed(2)}</td>
+                <td>{formatDollars(holding.market_value)}</td>
                 <td>${holding.unit_cost.toFixed(2)}</td>
                 <td>${holding.total_cost.toFixed(2)}</td>
               </tr>
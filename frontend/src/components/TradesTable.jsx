@@ -2,24 +2,42 @@ import React, { useEffect, useState } from "react";
 import axios from "axios";
 
 const API_BASE_URL = "http://localhost:8000"; // Backend URL
+const PAGE_SIZE = 100; // Trades fetched per page
 
 const TradesTable = () => {
   const [trades, setTrades] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  useEffect(() => {
-    axios.get(`${API_BASE_URL}/trades`)
+  const fetchPage = (cursor) => {
+    const params = { limit: PAGE_SIZE };
+    if (cursor) {
+      params.cursor = cursor;
+    }
+    return axios.get(`${API_BASE_URL}/trades`, { params })
       .then((response) => {
-        setTrades(response.data.trades);
+        setTrades((previous) => (cursor ? [...previous, ...response.data.trades] : response.data.trades));
+        setNextCursor(response.data.next_cursor);
       })
       .catch((error) => {
         console.error("Error fetching trades:", error);
-      })
-      .finally(() => {
-        setLoading(false);
       });
+  };
+
+  useEffect(() => {
+    fetchPage(null).finally(() => {
+      setLoading(false);
+    });
   }, []);
 
+  const loadMore = () => {
+    setLoadingMore(true);
+    fetchPage(nextCursor).finally(() => {
+      setLoadingMore(false);
+    });
+  };
+
   if (loading) {
     return (
         <div style={{
@@ -75,6 +93,13 @@ const TradesTable = () => {
           )}
         </tbody>
       </table>
+      {nextCursor && (
+        <div style={{ textAlign: "center", margin: "20px" }}>
+          <button onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? "Loading..." : "Load more trades"}
+          </button>
+        </div>
+      )}
     </div>
   );
 };